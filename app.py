@@ -1,79 +1,385 @@
-import base64
+from collections import OrderedDict
+from functools import lru_cache, wraps
+import hashlib
+import inspect
+import logging
 import os
-import re
-from unidecode import unidecode
+import threading
 
-from dash import html, Dash, dcc, Input, Output, callback
+from dash import html, Dash, dcc, Input, Output, State, callback, callback_context, no_update
 import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
-from src.functions import prepare_team_data, get_player_events, get_player_shots, get_player_asists
+from src.functions import bin_events, count_by_bucket, get_player_events, get_player_shots, get_player_asists, parse_range
+from src.background import BACKGROUND_INTERVAL_MS, in_background_job, register_background_manager
+from src.cache import SCHEMA_VERSION
 from src.classes import FootballPitch
+from src.index import CumulativeXG, HeatmapCube
+from src.ingest import register_ingest_route
+from src.images import IMG_ROUTE, build_image_index, register_image_route
+from src.metrics import FIGURE_COALESCED, FIGURE_REQUESTS, observe_rows, register_metrics_route, timed
+from src.prewarm import start_prewarm
+from src.singleflight import SingleFlight
+from src.store import DEFAULT_PARTITIONS, DataStore, Partition, TeamData, parse_partitions
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
 # Constants
 COLOR_SCALE = px.colors.sequential.Reds[:1] + px.colors.sequential.Sunsetdark
 DIMENSIONS = (105, 68)
-EVENTS, SHOTS, ASSISTS = prepare_team_data()
-PLAYER_OPTIONS = ['All players'] + sorted(SHOTS['player'].unique().tolist())
-IMGS = {
-    img: base64.b64encode(open(os.getcwd()+'/src/img/'+img, 'rb').read()).decode('ascii')
-    for img in os.listdir(os.getcwd()+'/src/img')
-}
-ORDERED_MATCHDAYS = EVENTS.sort_values('match_date')['match_id'].unique().tolist()
+PITCH_ARC_POINTS = 100
+# Pitch markings as layout shapes instead of traces
+PITCH_COMPACT = True
+# Decimals sent to the browser, centimetres for coordinates
+COORD_DECIMALS = 2
+VALUE_DECIMALS = 3
+# Scatters with more points than this are drawn with WebGL
+SCATTERGL_MIN_POINTS = 1000
+# Minute sliders ending on 90 include the extra time up to this minute
+EXTRA_TIME_END = 130
+MINUTE_STEP = 15
+# Width in minutes of the shots by quarter buckets
+SHOTS_BUCKET_MINUTES = float(os.environ.get('DASHBOARD_SHOTS_BUCKET_MINUTES', 15))
+PARTITIONS = parse_partitions(os.environ['DASHBOARD_PARTITIONS']) if 'DASHBOARD_PARTITIONS' in os.environ else DEFAULT_PARTITIONS
+DEFAULT_PARTITION = PARTITIONS[0]
+STORE = DataStore(PARTITIONS, pitch_dimensions=DIMENSIONS)
+# Loaded at startup, the layout needs its players and matchdays. Only those
+# are kept, the data is evicted like any other partition's
+DEFAULT_PLAYER_OPTIONS = STORE.get(DEFAULT_PARTITION).player_options
+DEFAULT_N_MATCHDAYS = len(STORE.get(DEFAULT_PARTITION).ordered_matchdays)
+FILTER_CACHE_SIZE = 64
+FIGURE_CACHE_SIZE = 256
+# Heatmaps of minute ranges with these bounds (the slider's) are summed from
+# a cube per player and cell size, the rest are binned from the events
+HEATMAP_MINUTES = tuple(range(0, 91, MINUTE_STEP)) + (1, EXTRA_TIME_END)
+# Cubes of the least recently used heatmaps are dropped over this
+HEATMAP_CACHE_MB = float(os.environ.get('DASHBOARD_HEATMAP_CACHE_MB', 128))
+# Players whose cube would be larger than this are binned on every request
+HEATMAP_CUBE_MAX_MB = float(os.environ.get('DASHBOARD_HEATMAP_CUBE_MAX_MB', 32))
+# How often running sessions check for ingested matches
+DATA_REFRESH_SECONDS = float(os.environ.get('DASHBOARD_DATA_REFRESH_SECONDS', 30))
+# (game_range, minute_range) prewarmed for every player, None is every matchday
+PREWARM_RANGES = [(None, (1, 90))]
 
 # Variables
-div_factor = 3 # CONVERTIR A DROPDOWN
+heatmap_cell_size = 3 # CONVERTIR A DROPDOWN
 app = Dash(__name__) 
 server = app.server
+register_image_route(server)
+register_metrics_route(server)
+
+
+def data_version():
+    """
+    Identifies the data the callback of the current request reads (its
+    partition and matches), so background results stored on disk are never
+    served for other data, whichever worker or restart computed them
+    """
+    partition, data = get_partition(
+        callback_context.inputs.get('team_dropdown.value'), callback_context.inputs.get('season_dropdown.value')
+    )
+    return hashlib.sha1(repr((SCHEMA_VERSION, DIMENSIONS, tuple(partition), data.version)).encode()).hexdigest()
+
+
+BACKGROUND_MANAGER = register_background_manager(server, cache_by=[data_version])
+# Figure callbacks run as background jobs when DASHBOARD_BACKGROUND_DIR is set
+FIGURE_CALLBACK_OPTIONS = dict(
+    background=True, manager=BACKGROUND_MANAGER, interval=BACKGROUND_INTERVAL_MS
+) if BACKGROUND_MANAGER is not None else {}
+
+
+def season_value(partition: Partition):
+    return f'{partition.competition}|{partition.season}'
+
+
+def get_partition(team: str = None, season: str = None):
+    """
+    Returns the partition selected by the team and season dropdowns
+    (the default one when nothing is selected yet) and its data
+    """
+    if team is None or season is None:
+        partition = DEFAULT_PARTITION
+    else:
+        competition, season = season.split('|', 1)
+        partition = Partition(competition, season, team)
+    return partition, STORE.get(partition)
+
+
+def scatter_trace(n_points: int):
+    return go.Scattergl if n_points > SCATTERGL_MIN_POINTS else go.Scatter
+
+
+def normalize_filters(game_range, minute_range=None):
+    """
+    Parses the slider values into hashable tuples, so every callback shares
+    the same filter cache entries
+    """
+    game_range = parse_range(game_range)
+    if minute_range is not None:
+        minute_range = parse_range(minute_range)
+        if 90 in minute_range:
+            # afegir extra time
+            minute_range = (minute_range[0], EXTRA_TIME_END)
+    return game_range, minute_range
+
+
+def cache_by_data(max_size: float, size=None):
+    """
+    Like lru_cache for functions of a TeamData (their first argument), bounded
+    by the total size(value) of the cached values (their number by default).
+    The last value is kept even if it alone is over max_size. discard(data)
+    drops the entries of data once it leaves the store, cached(*args) looks a
+    value up without computing it
+    """
+    size = size or (lambda value: 1)
+
+    def decorator(func):
+        cache = OrderedDict()
+        lock = threading.Lock()
+
+        @wraps(func)
+        def wrapper(*args):
+            with lock:
+                if args in cache:
+                    cache.move_to_end(args)
+                    return cache[args]
+
+            value = func(*args)
+            with lock:
+                cache[args] = value
+                while len(cache) > 1 and wrapper.size() > max_size:
+                    cache.popitem(last=False)
+            return value
+
+        def cached(*args):
+            """
+            The cached value of args, None without computing it if there is none
+            """
+            with lock:
+                return cache.get(args)
+
+        def cache_clear():
+            with lock:
+                cache.clear()
+
+        def discard(data: TeamData):
+            with lock:
+                for args in [args for args in cache if args[0] is data]:
+                    del cache[args]
+
+        wrapper.cached = cached
+        wrapper.cache_clear = cache_clear
+        wrapper.discard = discard
+        wrapper.size = lambda: sum(size(value) for value in list(cache.values()))
+        return wrapper
+    return decorator
+
+
+@cache_by_data(FILTER_CACHE_SIZE)
+def filter_player(data: TeamData, player: str, game_range: tuple, minute_range: tuple = None):
+    """
+    Positions of the rows of every frame of player within the selected matchdays
+    and minutes. Computed once per filter change and shared by all the callbacks.
+    Cached by data itself, so positions always match the frames they index.
+    Events only feed the heatmap counts, so their positions are left unsorted
+    """
+    return {
+        name: index.query(player, game_range[0]-1, game_range[1], minute_range, ordered=name != 'events')
+        for name, index in data.indexes.items()
+    }
+
+
+def filter_season(data: TeamData, game_range: tuple, minute_range: tuple = None):
+    """
+    Same as filter_player for all the players
+    """
+    return filter_player(data, 'All players', game_range, minute_range)
+
+
+def cache_figure(func):
+    """
+    Caches the figures of a callback by its inputs (range slider values are
+    made hashable) and the version of the data of its partition, so ingested
+    matches show up however the data changed (ingested here, mapped from
+    another process, reloaded after an eviction). Identical calls in flight
+    at once are computed once (see SingleFlight). Place it below @timed
+    """
+    cached = lru_cache(maxsize=FIGURE_CACHE_SIZE)(lambda partition, version, *args: func(*args))
+    flight = SingleFlight()
+    requests = FIGURE_REQUESTS.labels(func.__name__)
+    coalesced = FIGURE_COALESCED.labels(func.__name__)
+    signature = inspect.signature(func)
+
+    @wraps(func)
+    def wrapper(*args):
+        arguments = signature.bind(*args).arguments
+        partition, data = get_partition(arguments.get('team'), arguments.get('season'))
+        key = (partition, data.version, *(tuple(arg) if isinstance(arg, list) else arg for arg in args))
+        requests.inc()
+        fig, waited = flight.do(key, cached, *key)
+        if waited:
+            coalesced.inc()
+        return fig
+
+    wrapper.cache_clear = cached.cache_clear
+    wrapper.cache_info = cached.cache_info
+    return wrapper
+
+
+@cache_by_data(FILTER_CACHE_SIZE)
+def cumulative_xg(data: TeamData, minute_range: tuple = None):
+    """
+    Cumulative xG of data, built from the shots within minute_range when
+    it doesn't cover the whole match
+    """
+    if minute_range is None or (minute_range[0] <= 1 and minute_range[1] >= EXTRA_TIME_END):
+        return data.cumulative_xg
+
+    shots = data.shots.take(data.indexes['shots'].query('All players', minute_range=minute_range))
+    return CumulativeXG(shots, data.ordered_matchdays)
+
+
+@cache_by_data(HEATMAP_CACHE_MB * 1024**2, size=lambda cube: cube.nbytes if cube is not None else 0)
+def heatmap_cube(data: TeamData, player: str, cell_size: float):
+    """
+    HeatmapCube of the events of player on a default pitch, built on first use
+    and cached within HEATMAP_CACHE_MB. None when it would take more than
+    HEATMAP_CUBE_MAX_MB
+    """
+    pitch = FootballPitch()
+    rows = data.indexes['events'].query(player, ordered=False)
+    nbytes = HeatmapCube.estimate_nbytes(
+        len(rows), len(pd.unique(data.events['match_id'].to_numpy()[rows])), pitch.pitch_length, pitch.pitch_width,
+        cell_size, HEATMAP_MINUTES
+    )
+    if nbytes > HEATMAP_CUBE_MAX_MB * 1024**2:
+        return None
+
+    events = get_player_events(player, data.events.take(rows), pitch)
+    cube = HeatmapCube(events, data.ordered_matchdays, pitch.pitch_length, pitch.pitch_width, cell_size, HEATMAP_MINUTES)
+    logging.info(
+        'Heatmap cube of %s (%gm cells) uses %.2f MB, %.1f MB of cubes cached', player, cell_size,
+        cube.nbytes / 1024**2, heatmap_cube.size() / 1024**2
+    )
+    return cube
+
+
+@lru_cache(maxsize=None)
+def player_images(partition: Partition, players: tuple):
+    """
+    Image of every player of partition, players without one are logged once
+    """
+    images, missing = build_image_index(players)
+    if missing:
+        logging.warning('Players without image in %s: %s', '/'.join(partition), ', '.join(missing))
+    return images
+
+
+def season_options(team: str):
+    return [
+        {'label': f'{partition.competition} {partition.season}', 'value': season_value(partition)}
+        for partition in STORE.seasons(team)
+    ]
+
+
+def matchday_marks(n_matchdays: int):
+    return {k:str(k) for k in range(1, n_matchdays, 4)}
+
 
 @callback(
-    Output('player_img', 'src'),
-    Input('player_dropdown', 'value')
+    Output('season_dropdown', 'options'),
+    Output('season_dropdown', 'value'),
+    Input('team_dropdown', 'value'),
+    Input('season_dropdown', 'value')
+)
+@timed
+def update_season_options(team, season):
+    options = season_options(team)
+    values = [option['value'] for option in options]
+    return options, season if season in values else values[0]
+
+
+@callback(
+    Output('player_dropdown', 'options'),
+    Output('player_dropdown', 'value'),
+    Output('game_slider', 'max'),
+    Output('game_slider', 'marks'),
+    Output('game_slider', 'value'),
+    Input('team_dropdown', 'value'),
+    Input('season_dropdown', 'value'),
+    Input('data_refresh', 'n_intervals'),
+    State('player_dropdown', 'value'),
+    State('game_slider', 'max'),
+    State('game_slider', 'value')
 )
-def update_player_img(player):
-    norm_player = unidecode(re.sub(r'\W+', '', player)).lower()
+@timed
+def update_partition_filters(team, season, n_intervals=None, player=None, shown_matchdays=None, game_range=None):
+    """
+    Players and matchdays of the selected partition. On a refresh they only
+    change when matches were ingested since: the selected player is kept and
+    a range ending on the last matchday is extended to the new ones
+    """
+    _, data = get_partition(team, season)
+    n_matchdays = len(data.ordered_matchdays)
+    if n_intervals is None or callback_context.triggered_id != 'data_refresh':
+        return data.player_options, 'All players', n_matchdays, matchday_marks(n_matchdays), [1, n_matchdays]
+
+    if n_matchdays == shown_matchdays:
+        return (no_update,) * 5
+    player = player if player in data.player_options else 'All players'
+    start, stop = parse_range(game_range)
+    stop = n_matchdays if stop >= shown_matchdays else min(stop, n_matchdays)
+    return data.player_options, player, n_matchdays, matchday_marks(n_matchdays), [min(start, stop), stop]
 
-    for player_img in IMGS:
-        if norm_player in player_img:
-            return f'data:image/jpeg;base64,{IMGS[player_img]}'
-        
-    return ''
+
+@callback(
+    Output('player_img', 'src'),
+    Input('player_dropdown', 'value'),
+    Input('team_dropdown', 'value'),
+    Input('season_dropdown', 'value')
+)
+@timed
+def update_player_img(player, team=None, season=None):
+    partition, data = get_partition(team, season)
+    images = player_images(partition, tuple(data.player_options))
+    if player not in images:
+        return ''
+    return app.get_relative_path(IMG_ROUTE + images[player])
 
 @callback(
     Output('shot_distribution', 'figure'),
     Input('player_dropdown', 'value'),
     Input('game_slider', 'value'),
-    Input('minute_slider', 'value')
+    Input('minute_slider', 'value'),
+    Input('team_dropdown', 'value'),
+    Input('season_dropdown', 'value'),
+    **FIGURE_CALLBACK_OPTIONS
 )
-def create_shot_distribution(player, game_range, minute_range):
+@timed
+@cache_figure
+def create_shot_distribution(player, game_range, minute_range, team=None, season=None):
+    _, data = get_partition(team, season)
     pitch = FootballPitch(half=True)
-    fig = pitch.plot_pitch(False, bg_color='#C1E1C1', zoom_ratio=0.8) 
+    fig = pitch.plot_pitch(False, bg_color='#C1E1C1', zoom_ratio=0.8, arc_points=PITCH_ARC_POINTS, compact=PITCH_COMPACT)
 
     # Apply filters
-    if isinstance(game_range, str):
-        game_range = game_range[1:-1].split(',')
-    if isinstance(minute_range, str):
-        minute_range = minute_range[1:-1].split(',')
-    if 90 in minute_range:
-        # afegir extra time
-        minute_range[1] = 130
-
-    player_shots = get_player_shots(player, SHOTS.copy(), pitch)
-    player_shots = player_shots[
-        (player_shots['match_id'].isin(ORDERED_MATCHDAYS[int(game_range[0])-1:int(game_range[1])]))
-        & (player_shots['float_time'].between(int(minute_range[0])-1, int(minute_range[1])))
-    ]
+    game_range, minute_range = normalize_filters(game_range, minute_range)
+
+    rows = filter_player(data, player, game_range, minute_range)
+    player_shots = get_player_shots(player, data.shots.take(rows['shots']), pitch)
+    observe_rows('create_shot_distribution', len(player_shots))
     #print(player_shots)
 
     scatter_colors = ["#E7E657", "#57C8E7"]
 
     for i, group in enumerate([True, False]):
-        fig.add_trace(go.Scatter(
-            x=player_shots[player_shots['goal'] == group]['x'],
-            y=player_shots[player_shots['goal'] == group]['y'],
+        group_shots = player_shots[player_shots['goal'] == group]
+        fig.add_trace(scatter_trace(len(group_shots))(
+            x=group_shots['x'].round(COORD_DECIMALS),
+            y=group_shots['y'].round(COORD_DECIMALS),
             mode="markers",
             name='Goal' if group else 'No Goal',
             marker=dict(
@@ -99,32 +405,30 @@ def create_shot_distribution(player, game_range, minute_range):
     Output('assist_distribution', 'figure'),
     Input('player_dropdown', 'value'),
     Input('game_slider', 'value'),
-    Input('minute_slider', 'value')
+    Input('minute_slider', 'value'),
+    Input('team_dropdown', 'value'),
+    Input('season_dropdown', 'value'),
+    **FIGURE_CALLBACK_OPTIONS
 )
-def create_assist_distribution(player, game_range, minute_range):
+@timed
+@cache_figure
+def create_assist_distribution(player, game_range, minute_range, team=None, season=None):
+    _, data = get_partition(team, season)
     pitch = FootballPitch(half=True)
-    fig = pitch.plot_pitch(False, bg_color='#C1E1C1', zoom_ratio=0.8) 
+    fig = pitch.plot_pitch(False, bg_color='#C1E1C1', zoom_ratio=0.8, arc_points=PITCH_ARC_POINTS, compact=PITCH_COMPACT)
 
     # Apply filters
-    if isinstance(game_range, str):
-        game_range = game_range[1:-1].split(',')
-    if isinstance(minute_range, str):
-        minute_range = minute_range[1:-1].split(',')
-    if 90 in minute_range:
-        # afegir extra time
-        minute_range[1] = 130
-
-    player_assists = get_player_asists(player, ASSISTS.copy(), pitch)
-    player_assists = player_assists[
-        (player_assists['match_id'].isin(ORDERED_MATCHDAYS[int(game_range[0])-1:int(game_range[1])]))
-        & (player_assists['float_time'].between(int(minute_range[0])-1, int(minute_range[1])))
-    ]
+    game_range, minute_range = normalize_filters(game_range, minute_range)
+
+    rows = filter_player(data, player, game_range, minute_range)
+    player_assists = get_player_asists(player, data.assists.take(rows['assists']), pitch)
+    observe_rows('create_assist_distribution', len(player_assists))
 
     scatter_colors = ["#E7E657", "#57C8E7"]
  
-    fig.add_trace(go.Scatter(
-        x=player_assists['x'],
-        y=player_assists['y'],
+    fig.add_trace(scatter_trace(len(player_assists))(
+        x=player_assists['x'].round(COORD_DECIMALS),
+        y=player_assists['y'].round(COORD_DECIMALS),
         mode="markers",
         #name='Goal' if group else 'No Goal',
         marker=dict(
@@ -150,48 +454,37 @@ def create_assist_distribution(player, game_range, minute_range):
     Output('player_heatmap', 'figure'),
     Input('player_dropdown', 'value'),
     Input('game_slider', 'value'),
-    Input('minute_slider', 'value')
+    Input('minute_slider', 'value'),
+    Input('team_dropdown', 'value'),
+    Input('season_dropdown', 'value'),
+    **FIGURE_CALLBACK_OPTIONS
 )
-def create_player_heatmap(player, game_range, minute_range):
+@timed
+@cache_figure
+def create_player_heatmap(player, game_range, minute_range, team=None, season=None):
+    _, data = get_partition(team, season)
     pitch = FootballPitch()
 
     # Apply filters
-    if isinstance(game_range, str):
-        game_range = game_range[1:-1].split(',')
-    if isinstance(minute_range, str):
-        minute_range = minute_range[1:-1].split(',')
-    if 90 in minute_range:
-        # afegir extra time
-        minute_range[1] = 130
-
-    player_events = get_player_events(player, EVENTS.copy(), pitch)
-    player_events = player_events[
-        (player_events['match_id'].isin(ORDERED_MATCHDAYS[int(game_range[0])-1:int(game_range[1])]))
-        & (player_events['float_time'].between(int(minute_range[0])-1, int(minute_range[1])))
-    ]
+    game_range, minute_range = normalize_filters(game_range, minute_range)
+
+    # A background job would build the cube only to throw it away when it
+    # exits, it uses the cubes the worker had when it forked or bins the rows
+    if in_background_job():
+        cube = heatmap_cube.cached(data, player, heatmap_cell_size)
+    else:
+        cube = heatmap_cube(data, player, heatmap_cell_size)
+    counts = cube.query(game_range[0]-1, game_range[1], minute_range) if cube is not None else None
+    if counts is None:
+        rows = filter_player(data, player, game_range, minute_range)
+        player_events = get_player_events(player, data.events.take(rows['events']), pitch)
+        counts = bin_events(
+            player_events['x'], player_events['y'], pitch.pitch_length, pitch.pitch_width, heatmap_cell_size
+        )
+    observe_rows('create_player_heatmap', counts.sum())
+
+    fig = pitch.plot_heatmap(counts, zsmooth='best', zoom_ratio=0.8, arc_points=PITCH_ARC_POINTS, compact=PITCH_COMPACT)
 
-    xy = div_factor * (player_events[['x', 'y', 'minutes']]/div_factor).round()
-    xy = xy.groupby(['x', 'y']).count()[['minutes']]
-
-    data = []
-    for j in range(0, int(pitch.pitch_width), div_factor):
-        for i in range(0, int(pitch.pitch_length), div_factor):
-            #print(j, i)
-            if i == 0 and j < pitch.pitch_width:
-                data += [[]]
-            if j < pitch.pitch_width:
-                try:
-                    if (i, j) in xy.index:
-                        data[int(j/div_factor)].append(xy.loc[(i,j)].values[0])
-                    else:
-                        data[int(j/div_factor)].append(0)
-                except:
-                    pass
-                
-    data = np.asarray(data)
-
-    if data.any():
-        fig = pitch.plot_heatmap(data, zsmooth='best', zoom_ratio=0.8)
     fig.update_layout(
     #    title='Player Heatmap'
         margin=dict(l=20, r=20, t=25, b=20),
@@ -202,50 +495,50 @@ def create_player_heatmap(player, game_range, minute_range):
 
 
 @callback(
-    Output('shots_by_quarter', 'figure'),
-    Input('player_dropdown', 'value'),
-    Input('game_slider', 'value')
+    Output('shots_by_quarter_series', 'data'),
+    Input('game_slider', 'value'),
+    Input('team_dropdown', 'value'),
+    Input('season_dropdown', 'value'),
+    **FIGURE_CALLBACK_OPTIONS
 )
-def create_shots_by_quarter(player, game_range):
+@timed
+@cache_figure
+def create_shots_by_quarter(game_range, team=None, season=None):
+    """
+    Series of every player for the selected matchdays. The selected player is
+    highlighted in the browser by the clientside callback below, so changing
+    it doesn't reach the server
+    """
+    _, data = get_partition(team, season)
     fig = make_subplots()
 
     # Apply filters
-    if isinstance(game_range, str):
-        game_range = game_range[1:-1].split(',')
-
-    shots = SHOTS[
-        (SHOTS['match_id'].isin(ORDERED_MATCHDAYS[int(game_range[0])-1:int(game_range[1])]))
-    ]
-
-    max_shots = 0
+    game_range, _ = normalize_filters(game_range)
+    shots = data.shots.take(filter_season(data, game_range)['shots'])
+    observe_rows('create_shots_by_quarter', len(shots))
 
-    for p in shots.player.unique():
-        player_shots = get_player_shots(p, shots)
+    counts, team_avg = count_by_bucket(shots, SHOTS_BUCKET_MINUTES)
+    max_shots = counts.max() if len(counts) else 0
 
-        xy = 15 * (player_shots[['float_time', 'minutes']]/15).round()
-        xy = xy.groupby(['float_time']).count()[['minutes']]
-
-        max_shots = xy.minutes.max() if xy.minutes.max() > max_shots else max_shots
-        
+    # Traces keep the order players first appear in
+    for p in shots.player.dropna().unique():
+        xy = counts.loc[p]
         fig.add_trace(
             go.Scatter(
                 name=p,
                 x = xy.index, 
-                y = xy.minutes,
+                y = xy.values,
                 mode='lines',
-                opacity=1 if p == player else 0.2
+                opacity=0.2
             )
         )
 
     # Add team's avg
-    xy = 15 * (shots[['float_time', 'minutes']]/15).round()
-    xy = xy.groupby(['float_time']).count()[['minutes']]/len(shots.player.unique())
-
     fig.add_trace(
         go.Scatter(
             name="Team's Average",
-            x = xy.index, 
-            y = xy.minutes,
+            x = team_avg.index, 
+            y = team_avg.round(VALUE_DECIMALS),
             line = go.scatter.Line(dash='dash'),
             marker=None,
             mode='lines'
@@ -258,7 +551,7 @@ def create_shots_by_quarter(player, game_range):
         margin=dict(l=20, r=20, t=5, b=20),
         xaxis = dict(
             tickmode = 'array',
-            tickvals = xy.index.values
+            tickvals = team_avg.index.values
         ),
         height=200,
         plot_bgcolor="#F9F9F9", #COLOR_SCALE[0],
@@ -269,72 +562,78 @@ def create_shots_by_quarter(player, game_range):
     return fig
 
 
+# Highlight the selected player's series, the rest stay translucent
+app.clientside_callback(
+    """
+    function(figure, player) {
+        if (!figure) {
+            return window.dash_clientside.no_update;
+        }
+        const data = figure.data.map(trace => trace.name === "Team's Average" ? trace : {
+            ...trace, opacity: trace.name === player ? 1 : 0.2
+        });
+        return {...figure, data: data};
+    }
+    """,
+    Output('shots_by_quarter', 'figure'),
+    Input('shots_by_quarter_series', 'data'),
+    Input('player_dropdown', 'value')
+)
+
+
 @callback(
     Output('goals_vs_xg', 'figure'),
     Input('player_dropdown', 'value'),
     Input('game_slider', 'value'),
-    Input('minute_slider', 'value')
+    Input('minute_slider', 'value'),
+    Input('team_dropdown', 'value'),
+    Input('season_dropdown', 'value'),
+    **FIGURE_CALLBACK_OPTIONS
 )
-def create_goals_vs_xg(player, game_range, minute_range):
+@timed
+@cache_figure
+def create_goals_vs_xg(player, game_range, minute_range, team=None, season=None):
+    _, data = get_partition(team, season)
 
     # Apply filters
-    if isinstance(game_range, str):
-        game_range = game_range[1:-1].split(',')
-    if isinstance(minute_range, str):
-        minute_range = minute_range[1:-1].split(',')
-    if 90 in minute_range:
-        # afegir extra time
-        minute_range[1] = 130
-
-    shots = SHOTS[
-        (SHOTS['match_id'].isin(ORDERED_MATCHDAYS[int(game_range[0])-1:int(game_range[1])]))
-        & (SHOTS['float_time'].between(int(minute_range[0])-1, int(minute_range[1])))
-    ]
+    game_range, minute_range = normalize_filters(game_range, minute_range)
+    cumulative = cumulative_xg(data, minute_range)
+    start, stop = game_range[0]-1, game_range[1]
 
-    # Compute team's avg xg and cumsum it
-    team_avg_xg = pd.merge(shots.groupby('match_id')[['shot_statsbomb_xg']].sum(), shots.groupby('match_id')[['player']].nunique(), on='match_id')
-    team_avg_xg['team_avg_xg'] = team_avg_xg['shot_statsbomb_xg']/team_avg_xg['player']
-
-    goals_vs_expected = team_avg_xg.copy()
-    data = []
+    # Team's avg xg over the matchdays with shots, or the player's ones
+    matchdays = None
+    traces = []
 
     if player != 'All players':
-        player_shots = get_player_shots(player, shots)
-
-        goals_vs_expected = player_shots.groupby(['match_id', 'player'])[['shot_statsbomb_xg', 'goal']].sum()
-        
-        # Add cum values
-        goals_vs_expected['cum_goal'] = goals_vs_expected['goal'].cumsum()
-        goals_vs_expected['cum_shot_statsbomb_xg'] = goals_vs_expected['shot_statsbomb_xg'].cumsum()
+        matchdays, cum_xg, cum_goal = cumulative.player(player, start, stop)
 
-        data = [
+        traces = [
             go.Scatter(
                 name='xG over time', 
-                x = [*range(len(goals_vs_expected.index.get_level_values(0)))], 
-                y=goals_vs_expected['cum_shot_statsbomb_xg'],
+                x = [*range(len(matchdays))], 
+                y=cum_xg.round(VALUE_DECIMALS),
                 marker=None,
                 marker_color=COLOR_SCALE[-1]
             ),
             go.Scatter(
                 name='goals over time', 
-                x = [*range(len(goals_vs_expected.index.get_level_values(0)))], 
-                y=goals_vs_expected['cum_goal'],
+                x = [*range(len(matchdays))], 
+                y=cum_goal,
                 marker=None,
                 marker_color=COLOR_SCALE[0]
             )
         ]
 
-        # Team avg
-        goals_vs_expected = goals_vs_expected.merge(team_avg_xg, on='match_id')
-        
+        if not len(matchdays):
+            matchdays = None
 
-    goals_vs_expected['cum_team_avg_xg'] = team_avg_xg['team_avg_xg'].cumsum()
+    cum_team_avg_xg = cumulative.team(start, stop, matchdays)
     
-    fig = go.Figure(data = data + [
+    fig = go.Figure(data = traces + [
         go.Scatter(
             name="Team's avg xG over time", 
-            x = [*range(len(goals_vs_expected.index.get_level_values(0)))], 
-            y=goals_vs_expected['cum_team_avg_xg'], 
+            x = [*range(len(cum_team_avg_xg))], 
+            y=cum_team_avg_xg.round(VALUE_DECIMALS), 
             line = go.scatter.Line(dash='dash'),
             marker_color=COLOR_SCALE[-2]
         )
@@ -346,7 +645,7 @@ def create_goals_vs_xg(player, game_range, minute_range):
         height=200,
         plot_bgcolor="#F9F9F9", #COLOR_SCALE[0],
         paper_bgcolor="#F9F9F9", #COLOR_SCALE[0],
-        yaxis_range=[-3, goals_vs_expected['cum_team_avg_xg'].max()+5]
+        yaxis_range=[-3, (cum_team_avg_xg.max() if len(cum_team_avg_xg) else np.nan)+5]
     )
 
     return fig
@@ -383,7 +682,19 @@ assist_distribution_graph = html.Div(
 )
 
 filter = html.Div([
-    dcc.Dropdown(PLAYER_OPTIONS,
+    dcc.Dropdown(STORE.teams(),
+        DEFAULT_PARTITION.team,
+        id='team_dropdown',
+        clearable=False,
+        style={'width': '200px', 'margin': '20px auto 0', 'text-align': 'left'}
+    ),
+    dcc.Dropdown(season_options(DEFAULT_PARTITION.team),
+        season_value(DEFAULT_PARTITION),
+        id='season_dropdown',
+        clearable=False,
+        style={'width': '200px', 'margin': '10px auto 0', 'text-align': 'left'}
+    ),
+    dcc.Dropdown(DEFAULT_PLAYER_OPTIONS,
         'All players', 
         id='player_dropdown', 
         style={'width': '200px', 'margin': '20px auto', 'text-align': 'left'}
@@ -396,18 +707,20 @@ filter = html.Div([
         'Matchdays:', style={'text-align': 'left'}
     ),
     dcc.RangeSlider(
-        1, 38, 1, 
-        {k:str(k) for k in range(1, 38, 4)}, 
-        value=[1, 38], id='game_slider', allowCross=False,
+        1, DEFAULT_N_MATCHDAYS, 1, 
+        matchday_marks(DEFAULT_N_MATCHDAYS), 
+        value=[1, DEFAULT_N_MATCHDAYS], id='game_slider', allowCross=False,
     ),
     html.P(
         'Time in match:', style={'text-align': 'left', 'margin-top': '20px'}
     ),
     dcc.RangeSlider(
-        0, 90, 15, 
-        {k:str(k) for k in range(0, 91, 15)}, 
+        0, 90, MINUTE_STEP, 
+        {k:str(k) for k in range(0, 91, MINUTE_STEP)}, 
         value=[1, 90], id='minute_slider', allowCross=False
-    )
+    ),
+    # Running sessions pick up ingested matches
+    dcc.Interval(id='data_refresh', interval=DATA_REFRESH_SECONDS * 1000)
     ], style={
         'grid-column-start' : 'third',
         'grid-column-end' : 'span 1',
@@ -457,7 +770,8 @@ heatmap_text = html.Div([
 shots_by_quarter = html.Div(
     [
         html.H2('Shots By Quarter', style={'margin-top': '20px'}),
-        dcc.Graph(id='shots_by_quarter', figure={})
+        dcc.Graph(id='shots_by_quarter', figure={}),
+        dcc.Store(id='shots_by_quarter_series')
     ],
     style={
         'grid-column-start' : 'first',
@@ -498,6 +812,48 @@ app.layout = html.Div([
     })
 ], style={'text-align': 'center'})
 
+def prewarm_tasks(partition: Partition):
+    """
+    (callback, inputs) of every player of partition at PREWARM_RANGES, with
+    the inputs the dropdowns and sliders send
+    """
+    data = STORE.get(partition)
+    team, season = partition.team, season_value(partition)
+    tasks = []
+    for game_range, minute_range in PREWARM_RANGES:
+        game_range = list(game_range or (1, len(data.ordered_matchdays)))
+        tasks.append((create_shots_by_quarter, (game_range, team, season)))
+        for player in data.player_options:
+            tasks += [
+                (func, (player, game_range, list(minute_range), team, season)) for func in [
+                    create_shot_distribution, create_assist_distribution, create_player_heatmap, create_goals_vs_xg
+                ]
+            ]
+    return tasks
+
+
+def release_partition(partition: Partition, data: TeamData):
+    """
+    Drops the cache entries of data, which left the store. They would keep
+    it in memory over the budget, the entries of other data stay
+    """
+    for cache in [filter_player, cumulative_xg, heatmap_cube]:
+        cache.discard(data)
+
+
+def on_ingest(partition: Partition):
+    """
+    Prewarms the figures of the data with the new match
+    """
+    start_prewarm(prewarm_tasks(partition))
+
+
+STORE.release_hooks.append(release_partition)
+register_ingest_route(server, STORE, on_ingest)
+# The default partition's images are indexed before the first request
+player_images(DEFAULT_PARTITION, tuple(DEFAULT_PLAYER_OPTIONS))
+start_prewarm(prewarm_tasks(DEFAULT_PARTITION))
+
 # Run app
 if __name__ == '__main__':
     app.run(debug=True)
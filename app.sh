@@ -1,2 +1,2 @@
 #!/bin/bash
-pipenv run python3 app.py
\ No newline at end of file
+python3 app.py
\ No newline at end of file
@@ -0,0 +1,151 @@
+"""
+Background callbacks on a local job queue.
+
+With DASHBOARD_BACKGROUND_DIR set, the figure callbacks run as Dash
+background callbacks: every job is a process forked from the worker (so it
+sees its loaded partitions and caches) and its figure is stored in a
+diskcache in that directory, shared by every worker and reused for the same
+inputs. No broker is needed.
+
+Jobs of a callback the browser triggers again before they finish (dragging
+a slider) are terminated by Dash. On top of that, a browser session (a
+cookie) runs at most DASHBOARD_MAX_SESSION_JOBS jobs at once, further jobs
+wait for a running one to finish (never terminating it, its panel would
+not update) for up to DASHBOARD_SESSION_WAIT_SECONDS.
+"""
+import os
+import time
+import uuid
+
+from dash import DiskcacheManager
+from flask import has_request_context, request
+
+from src.metrics import BACKGROUND_JOBS
+
+BACKGROUND_DIR = os.environ.get('DASHBOARD_BACKGROUND_DIR')
+MAX_SESSION_JOBS = int(os.environ.get('DASHBOARD_MAX_SESSION_JOBS', 5))
+# How often the browser polls for the result of a job
+BACKGROUND_INTERVAL_MS = int(os.environ.get('DASHBOARD_BACKGROUND_INTERVAL_MS', 250))
+SESSION_COOKIE = 'dashboard_session'
+# Job lists of the sessions idle for longer are dropped
+SESSION_EXPIRE_SECONDS = 24 * 3600
+# Reserved slots whose job never started (its worker died) are freed after
+RESERVATION_SECONDS = 30
+# Jobs over the session cap wait this long for a slot, then start anyway
+SESSION_WAIT_SECONDS = float(os.environ.get('DASHBOARD_SESSION_WAIT_SECONDS', 30))
+SESSION_POLL_SECONDS = 0.05
+
+# Set in the job processes, see in_background_job
+_in_job = False
+
+
+def in_background_job():
+    """
+    Whether this process runs a background job. Whatever a job caches is lost
+    when it exits, so work only worth its cost when reused is left out
+    """
+    return _in_job
+
+
+def _mark_job(job_fn):
+    def run(*args):
+        global _in_job
+        _in_job = True
+        return job_fn(*args)
+    return run
+
+
+class SessionJobManager(DiskcacheManager):
+    """
+    DiskcacheManager running at most max_jobs jobs per session. The jobs of
+    every session are kept in the cache, so the cap holds across workers
+    """
+
+    def __init__(self, cache, cache_by=None, max_jobs: int = MAX_SESSION_JOBS):
+        super().__init__(cache, cache_by)
+        self.max_jobs = max_jobs
+
+
+    def call_job_fn(self, key, job_fn, args, context):
+        # Jobs are forked, so the wrapper doesn't need to be picklable
+        job_fn = _mark_job(job_fn)
+        session = request.cookies.get(SESSION_COOKIE) if has_request_context() else None
+        if session is None:
+            BACKGROUND_JOBS.labels('started').inc()
+            return super().call_job_fn(key, job_fn, args, context)
+
+        # Entries are [reservation, job (None until started), reserved at].
+        # Checking for a free slot and reserving it happen in one transaction,
+        # so concurrent requests of a session (other workers included) can't
+        # both take the last one
+        jobs_key = f'session-slots-{session}'
+        reservation = uuid.uuid4().hex
+        deadline = time.monotonic() + SESSION_WAIT_SECONDS
+        waited = False
+        while True:
+            with self.handle.transact():
+                jobs = [entry for entry in self.handle.get(jobs_key, []) if self._alive(entry)]
+                full = len(jobs) >= self.max_jobs and time.monotonic() < deadline
+                if not full:
+                    jobs.append([reservation, None, time.time()])
+                self.handle.set(jobs_key, jobs, expire=SESSION_EXPIRE_SECONDS)
+            if not full:
+                break
+            # Jobs of other panels are never terminated for this one, it waits
+            # until one of them finishes (superseded ones were terminated by Dash)
+            waited = True
+            time.sleep(SESSION_POLL_SECONDS)
+        if waited:
+            BACKGROUND_JOBS.labels('waited').inc()
+
+        try:
+            job = super().call_job_fn(key, job_fn, args, context)
+        except Exception:
+            self._update(jobs_key, reservation, None)
+            raise
+        BACKGROUND_JOBS.labels('started').inc()
+        self._update(jobs_key, reservation, job)
+        return job
+
+
+    def _update(self, jobs_key: str, reservation: str, job):
+        """
+        Records the job started for reservation, frees the slot when job is
+        None
+        """
+        with self.handle.transact():
+            jobs = self.handle.get(jobs_key, [])
+            if job is None:
+                jobs = [entry for entry in jobs if entry[0] != reservation]
+            else:
+                for entry in jobs:
+                    if entry[0] == reservation:
+                        entry[1] = job
+            self.handle.set(jobs_key, jobs, expire=SESSION_EXPIRE_SECONDS)
+
+
+    def _alive(self, entry):
+        _, job, reserved_at = entry
+        if job is None:
+            return time.time() - reserved_at < RESERVATION_SECONDS
+        return self.job_running(job)
+
+
+def register_background_manager(server, directory: str = BACKGROUND_DIR, cache_by=None):
+    """
+    Returns the manager of the background callbacks (None when directory is
+    not set) and gives every browser a session cookie
+    """
+    if not directory:
+        return None
+
+    # Imported here, only needed with background callbacks
+    import diskcache
+
+    @server.after_request
+    def set_session(response):
+        if SESSION_COOKIE not in request.cookies:
+            response.set_cookie(SESSION_COOKIE, uuid.uuid4().hex, httponly=True, samesite='Lax')
+        return response
+
+    return SessionJobManager(diskcache.Cache(directory), cache_by)
@@ -0,0 +1,242 @@
+"""
+Latency benchmark of the dashboard callbacks on synthetic data (no network).
+
+Every scale (number of seasons) is written as its own partition to a
+temporary cache, then every callback is timed over a grid of players,
+matchday ranges and minute ranges. Filter caches are cleared between grid
+points, so each one is timed like a fresh input change, including the JSON
+serialization of the figure. The report is JSON with the p50/p95 latency and
+the figure payload size per callback and scale, plus the memory of every
+partition (frames and indexes) per event, with its frames compacted and as
+they were before (compact_frame), and of the heatmap cubes of the
+timed players, which are built once and kept like the indexes. The heatmap
+binning of all the events (bin_events) is also timed against the loop it
+replaced:
+
+    python -m src.benchmark --seasons 1 10 --repeats 5 --output bench.json
+"""
+import argparse
+import importlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import plotly.io as pio
+
+CALLBACKS = [
+    'create_shot_distribution',
+    'create_assist_distribution',
+    'create_player_heatmap',
+    'create_shots_by_quarter',
+    'create_goals_vs_xg',
+]
+# Callbacks with only the game_slider input (the player is highlighted clientside)
+GAME_RANGE_ONLY = {'create_shots_by_quarter'}
+# Caches holding per partition data rather than filter results, never cleared
+KEPT_CACHES = {'player_images', 'heatmap_cube'}
+TEAM = 'Synthetic FC'
+COMPETITION = 'Synthetic League'
+
+
+def season_name(n_seasons: int):
+    return f'{n_seasons} seasons'
+
+
+def frames_nbytes(frames):
+    return sum(int(frame.memory_usage(deep=True).sum()) for frame in frames)
+
+
+def write_partitions(scales, cache_dir: str):
+    """
+    Writes one synthetic partition per scale to cache_dir. Returns the bytes
+    of the frames of every scale before compact_frame minus their compacted
+    bytes
+    """
+    # Imported here, src.cache reads DASHBOARD_CACHE_DIR at import
+    from src.cache import cache_path, write_team_data
+    from src.functions import compact_frame
+    from src.synthetic import synthetic_team_data
+
+    saved = {}
+    for n_seasons in scales:
+        start = time.perf_counter()
+        frames = synthetic_team_data(n_seasons, team=TEAM, compact=False)
+        uncompacted = frames_nbytes(frames)
+        frames = [compact_frame(frame) for frame in frames]
+        saved[n_seasons] = uncompacted - frames_nbytes(frames)
+        write_team_data(frames, cache_path(TEAM, COMPETITION, season_name(n_seasons), cache_dir))
+        logging.info(
+            'Generated %d seasons (%d events) in %.2fs', n_seasons, len(frames[0]), time.perf_counter() - start
+        )
+    return saved
+
+
+def filter_grid(n_matchdays: int, players):
+    """
+    (player, game_range, minute_range) combinations to time
+    """
+    game_ranges = [[1, n_matchdays], [1, min(38, n_matchdays)], [max(1, n_matchdays - 3), n_matchdays]]
+    minute_ranges = [[1, 90], [15, 60]]
+    return [
+        (player, game_range, minute_range)
+        for player in players for game_range in game_ranges for minute_range in minute_ranges
+    ]
+
+
+def bin_events_loop(events, length: float, width: float, cell_size: float = 3):
+    """
+    The heatmap binning bin_events replaced: rounds, groups and looks every
+    cell up with .loc. Kept as the reference bin_events is timed and tested
+    against
+    """
+    xy = cell_size * (events[['x', 'y', 'minutes']]/cell_size).round()
+    xy = xy.groupby(['x', 'y']).count()[['minutes']]
+
+    data = []
+    for j in range(0, int(width), cell_size):
+        data += [[]]
+        for i in range(0, int(length), cell_size):
+            if (i, j) in xy.index:
+                data[int(j/cell_size)].append(xy.loc[(i, j)].values[0])
+            else:
+                data[int(j/cell_size)].append(0)
+    return np.asarray(data)
+
+
+def time_binning(app, data, repeats: int):
+    """
+    Best of repeats milliseconds of bin_events and of bin_events_loop on the
+    "All players" events of every matchday
+    """
+    pitch = app.FootballPitch()
+    events = app.get_player_events(
+        'All players', data.events.take(data.indexes['events'].query(ordered=False)), pitch
+    )
+    dimensions = (pitch.pitch_length, pitch.pitch_width, app.heatmap_cell_size)
+    runs = {
+        'bin_events_ms': lambda: app.bin_events(events['x'], events['y'], *dimensions),
+        'bin_events_loop_ms': lambda: bin_events_loop(events, *dimensions),
+    }
+    timings = {}
+    for name, func in runs.items():
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        timings[name] = round(best * 1000, 3)
+    return timings
+
+
+def clear_caches(app):
+    for name in dir(app):
+        cache_clear = getattr(getattr(app, name), 'cache_clear', None)
+        if callable(cache_clear) and name not in KEPT_CACHES:
+            cache_clear()
+
+
+def run(scales, repeats: int = 3, cache_dir: str = None):
+    """
+    Returns one report row per (scale, callback)
+    """
+    cache_dir = cache_dir or tempfile.mkdtemp(prefix='dashboard-bench-')
+    # The app reads its partitions and cache location at import
+    os.environ['DASHBOARD_CACHE_DIR'] = cache_dir
+    os.environ['DASHBOARD_PARTITIONS'] = ';'.join(
+        f'{COMPETITION}|{season_name(n_seasons)}|{TEAM}' for n_seasons in scales
+    )
+    saved = write_partitions(scales, cache_dir)
+    app = importlib.import_module('app')
+
+    report = []
+    for n_seasons in scales:
+        season = f'{COMPETITION}|{season_name(n_seasons)}'
+        _, data = app.get_partition(TEAM, season)
+        # All players plus the first and last player of the dropdown
+        players = ['All players', data.player_options[1], data.player_options[-1]]
+        grid = filter_grid(len(data.ordered_matchdays), players)
+        # The same partition with the frames as they were before compact_frame
+        uncompacted_nbytes = data.nbytes + saved[n_seasons]
+        logging.info(
+            '%3d seasons use %.1f MB, %.1f bytes per event (%.1f MB, %.1f bytes per event uncompacted)', n_seasons,
+            data.nbytes / 1024**2, data.nbytes / len(data.events), uncompacted_nbytes / 1024**2,
+            uncompacted_nbytes / len(data.events)
+        )
+
+        start = time.perf_counter()
+        cubes = [app.heatmap_cube(data, player, app.heatmap_cell_size) for player in players]
+        cube_bytes = sum(cube.nbytes for cube in cubes if cube is not None)
+        logging.info(
+            '%3d seasons heatmap cubes of %d players built in %.2fs, %.1f MB (%d over the limit)', n_seasons,
+            len(players), time.perf_counter() - start, cube_bytes / 1024**2, cubes.count(None)
+        )
+
+        binning = time_binning(app, data, repeats)
+        logging.info(
+            '%3d seasons heatmap binning of %d events: bin_events %.2fms, previous loop %.2fms', n_seasons,
+            len(data.events), binning['bin_events_ms'], binning['bin_events_loop_ms']
+        )
+
+        timings = {name: [] for name in CALLBACKS}
+        payloads = {name: [] for name in CALLBACKS}
+        for _ in range(repeats):
+            for player, game_range, minute_range in grid:
+                clear_caches(app)
+                for name in CALLBACKS:
+                    if name in GAME_RANGE_ONLY:
+                        args = [list(game_range)]
+                    else:
+                        args = [player, list(game_range), list(minute_range)]
+                    start = time.perf_counter()
+                    fig = getattr(app, name)(*args, TEAM, season)
+                    payload = pio.to_json(fig, validate=False)
+                    timings[name].append(time.perf_counter() - start)
+                    payloads[name].append(len(payload))
+
+        for name in CALLBACKS:
+            latencies = np.asarray(timings[name]) * 1000
+            report.append({
+                'seasons': n_seasons,
+                'events': len(data.events),
+                'bytes_per_event': round(data.nbytes / len(data.events), 1),
+                'bytes_per_event_uncompacted': round(uncompacted_nbytes / len(data.events), 1),
+                'heatmap_cube_bytes': int(cube_bytes),
+                **binning,
+                'callback': name,
+                'calls': len(latencies),
+                'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+                'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+                'payload_p50_bytes': int(np.percentile(payloads[name], 50)),
+                'payload_max_bytes': int(np.max(payloads[name])),
+            })
+            logging.info(
+                '%3d seasons %-28s p50 %8.2fms p95 %8.2fms payload %d bytes', n_seasons, name,
+                report[-1]['p50_ms'], report[-1]['p95_ms'], report[-1]['payload_p50_bytes']
+            )
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard callbacks on synthetic data')
+    parser.add_argument('--seasons', type=int, nargs='+', default=[1, 10], help='scales to benchmark (1 to 100)')
+    parser.add_argument('--repeats', type=int, default=3, help='passes over the filter grid')
+    parser.add_argument('--cache-dir', default=None, help='synthetic partitions directory (a temp dir by default)')
+    parser.add_argument('--output', default=None, help='JSON report path (stdout by default)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    report = run(args.seasons, args.repeats, args.cache_dir)
+    output = open(args.output, 'w') if args.output else sys.stdout
+    json.dump({'repeats': args.repeats, 'results': report}, output, indent=2)
+    if args.output:
+        output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""
+Local on-disk cache for the frames returned by prepare_team_data.
+
+Frames are stored as Parquet files under
+<CACHE_DIR>/v<SCHEMA_VERSION>/<competition>/<season>/<team>/, so warm starts
+only read the files instead of downloading every match again.
+
+Matches ingested after the cache was built (see ingest_match_data) are
+stored on their own under <team>/matches/<match_id>/ and read along.
+
+Rebuild the cache from the command line with:
+
+    python -m src.cache --team Barcelona --competition "La Liga" --season 2015/2016
+"""
+import argparse
+import logging
+import os
+import re
+import shutil
+import time
+
+import pandas as pd
+from unidecode import unidecode
+
+from src.functions import (
+    FETCH_WORKERS, add_pitch_coordinates, compact_frame, concat_frames, prepare_match_data, prepare_team_data
+)
+from src.metrics import DATA_LOAD_SECONDS
+from src.sources import DATA_DIR, DataSource, default_source
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get(
+    'DASHBOARD_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data_cache')
+)
+# Bump whenever prepare_team_data changes the columns or dtypes it returns.
+# 2: compact dtypes without the location lists (see compact_frame)
+SCHEMA_VERSION = 2
+FRAME_NAMES = ('events', 'shots', 'assists')
+
+
+def _slug(value: str):
+    return re.sub(r'\W+', '_', unidecode(str(value))).strip('_').lower()
+
+
+def cache_path(team: str, competition: str, season: str, cache_dir: str = CACHE_DIR, version: int = SCHEMA_VERSION):
+    """
+    Returns the directory holding the cached frames of a team in a given season
+    """
+    return os.path.join(
+        cache_dir, f'v{version}', _slug(competition), _slug(season), _slug(team)
+    )
+
+
+def previous_cache_path(team: str, competition: str, season: str, cache_dir: str = CACHE_DIR):
+    """
+    Returns the directory of the latest cache of a team written by an older
+    SCHEMA_VERSION, None if there is none
+    """
+    for version in range(SCHEMA_VERSION - 1, 0, -1):
+        path = cache_path(team, competition, season, cache_dir, version)
+        if is_cached(path):
+            return path
+    return None
+
+
+def migrate_cache(previous: str, path: str):
+    """
+    Writes the frames cached in previous by an older SCHEMA_VERSION (the
+    season and its ingested matches) to path in the current schema. Matches
+    go first, readers only see the season once all of them are there
+    """
+    directories = [match_path for match_path in match_paths(previous) if is_cached(match_path)] + [previous]
+    for directory in directories:
+        frames = [compact_frame(pd.read_parquet(os.path.join(directory, f'{name}.parquet'))) for name in FRAME_NAMES]
+        write_team_data(frames, os.path.normpath(os.path.join(path, os.path.relpath(directory, previous))))
+
+
+def match_paths(path: str):
+    """
+    Directories of the matches ingested into the cache in path
+    """
+    matches_dir = os.path.join(path, 'matches')
+    if not os.path.isdir(matches_dir):
+        return []
+    return [os.path.join(matches_dir, name) for name in sorted(os.listdir(matches_dir))]
+
+
+def is_cached(path: str):
+    return all(os.path.exists(os.path.join(path, f'{name}.parquet')) for name in FRAME_NAMES)
+
+
+def write_team_data(frames, path: str):
+    """
+    Writes the (events, shots, assists) frames to path. Every file is written to
+    a temporary name first so concurrent readers never see a partial file.
+    """
+    os.makedirs(path, exist_ok=True)
+
+    for name, frame in zip(FRAME_NAMES, frames):
+        target = os.path.join(path, f'{name}.parquet')
+        tmp = f'{target}.{os.getpid()}.tmp'
+        frame.to_parquet(tmp)
+        os.replace(tmp, target)
+
+
+def cached_match_ids(path: str):
+    """
+    Matches of the season cached in path, ingested ones left out
+    """
+    return set(pd.read_parquet(os.path.join(path, 'events.parquet'), columns=['match_id'])['match_id'].unique().tolist())
+
+
+def read_team_data(path: str):
+    """
+    Reads back the (events, shots, assists) frames written by write_team_data
+    """
+    frames = [
+        [pd.read_parquet(os.path.join(directory, f'{name}.parquet')) for name in FRAME_NAMES]
+        for directory in [path] + [match_path for match_path in match_paths(path) if is_cached(match_path)]
+    ]
+    if len(frames) == 1:
+        return tuple(frames[0])
+    return tuple(concat_frames(frame_list) for frame_list in zip(*frames))
+
+
+def load_team_data(
+        team: str = 'Barcelona',
+        competition: str = 'La Liga',
+        season: str = '2015/2016',
+        rebuild: bool = False,
+        cache_dir: str = CACHE_DIR,
+        max_workers: int = FETCH_WORKERS,
+        pitch_dimensions: tuple = None,
+        source: DataSource = None
+    ):
+    """
+    Returns the events, shots and assists frames of a team, reading them from
+    the cache when possible and (re)building the cache otherwise.
+    With pitch_dimensions (length, width) the shots and assists also get their
+    coordinates scaled to that pitch (see add_pitch_coordinates), these are not
+    cached. Events are scaled per request, only a player's few are ever drawn.
+    """
+    path = cache_path(team, competition, season, cache_dir)
+    start = time.perf_counter()
+
+    # Caches of older schemas are migrated once instead of rebuilt
+    previous = None
+    if not rebuild and not is_cached(path):
+        previous = previous_cache_path(team, competition, season, cache_dir)
+    if previous is not None:
+        migrate_cache(previous, path)
+        logger.info('Migrated the cache of %s %s %s from %s', team, competition, season, previous)
+
+    if not rebuild and is_cached(path):
+        frames = read_team_data(path)
+        DATA_LOAD_SECONDS.labels('cache').observe(time.perf_counter() - start)
+        logger.info(
+            'Loaded %s %s %s from cache in %.2fs', team, competition, season, time.perf_counter() - start
+        )
+    else:
+        frames = prepare_team_data(team, competition, season, max_workers, source)
+        DATA_LOAD_SECONDS.labels('statsbomb').observe(time.perf_counter() - start)
+        logger.info(
+            'Built %s %s %s from statsbomb in %.2fs', team, competition, season, time.perf_counter() - start
+        )
+        write_team_data(frames, path)
+        # The rebuild has every match, the ingested ones included
+        shutil.rmtree(os.path.join(path, 'matches'), ignore_errors=True)
+
+    if pitch_dimensions is not None:
+        for frame in frames[1:]:
+            add_pitch_coordinates(frame, *pitch_dimensions)
+
+    return frames
+
+
+def ingest_match_data(
+        match_id: int,
+        team: str = 'Barcelona',
+        competition: str = 'La Liga',
+        season: str = '2015/2016',
+        cache_dir: str = CACHE_DIR,
+        pitch_dimensions: tuple = None,
+        source: DataSource = None
+    ):
+    """
+    Returns the events, shots and assists frames of one match of a team and
+    adds them to its cache, so the match survives restarts without rebuilding
+    the season. Matches ingested before are read back from the cache, None
+    when the match is part of the cached season (it would be read twice).
+    See load_team_data for pitch_dimensions
+    """
+    path = cache_path(team, competition, season, cache_dir)
+    match_path = os.path.join(path, 'matches', str(match_id))
+    start = time.perf_counter()
+
+    if is_cached(match_path):
+        frames = read_team_data(match_path)
+    elif is_cached(path) and match_id in cached_match_ids(path):
+        logger.info('Match %s of %s %s %s is already cached', match_id, team, competition, season)
+        return None
+    else:
+        frames = prepare_match_data(match_id, team, competition, season, source)
+        write_team_data(frames, match_path)
+        DATA_LOAD_SECONDS.labels('match').observe(time.perf_counter() - start)
+        logger.info(
+            'Ingested match %s of %s %s %s in %.2fs', match_id, team, competition, season, time.perf_counter() - start
+        )
+
+    if pitch_dimensions is not None:
+        for frame in frames[1:]:
+            add_pitch_coordinates(frame, *pitch_dimensions)
+
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the local team data cache')
+    parser.add_argument('--team', default='Barcelona')
+    parser.add_argument('--competition', default='La Liga')
+    parser.add_argument('--season', default='2015/2016')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--workers', type=int, default=FETCH_WORKERS, help='concurrent match downloads')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='local copy of the statsbomb open-data repository')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    load_team_data(
+        args.team, args.competition, args.season, rebuild=True, cache_dir=args.cache_dir, max_workers=args.workers,
+        source=default_source(args.data_dir)
+    )
+    # Time a warm read as well so both numbers end up in the output
+    load_team_data(args.team, args.competition, args.season, cache_dir=args.cache_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,39 @@
+import copy
+
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
+
+def _compact_template(name='plotly'):
+    """
+    The parts of template name that show on a pitch figure (axes are hidden),
+    a full template is several KB on every serialized figure
+    """
+    template = pio.templates[name]
+    return go.layout.Template(
+        layout=dict(
+            font=template.layout.font,
+            hoverlabel=template.layout.hoverlabel,
+            hovermode=template.layout.hovermode,
+            paper_bgcolor=template.layout.paper_bgcolor,
+            colorway=template.layout.colorway,
+        ),
+        data=dict(heatmap=[go.Heatmap(colorbar=template.data.heatmap[0].colorbar)])
+    )
+
 
 class FootballPitch():
     # ALL THE VALUES ARE IN METERS
     PITCH_LENGTH_METERS = 105
     PITCH_WIDTH_METERS = 68
     HALF = False
+    # Points used to draw every arc (corner arcs and penalty arcs)
+    ARC_POINTS = 5000
+    # Decimals kept on the coordinates of the compact pitch shapes
+    COMPACT_DECIMALS = 2
+    # Base pitch figures already drawn, shared by every instance
+    _base_figures = {}
     
     def __init__(self, 
                  pitch_length_meters = PITCH_LENGTH_METERS, 
@@ -23,14 +50,38 @@ class FootballPitch():
             self.pitch_length /= 2
         
     
-    def plot_pitch(self, show=True, plot_corner_arcs=False, line_color='white', bg_color='#60b922', zoom_ratio=1):
-        # Fig to update
-        fig = go.Figure()
-
+    def plot_pitch(self, show=True, plot_corner_arcs=False, line_color='white', bg_color='#60b922', zoom_ratio=1, arc_points=ARC_POINTS, compact=False, lines_above=False):
+        """
+        Returns a new figure with the pitch drawn. The pitch itself is only drawn
+        once per geometry and style, later calls get a copy of the cached figure.
+        With compact the markings are layout shapes instead of traces, which
+        take a fraction of the bytes once serialized. Shapes go below the data
+        traces unless lines_above (heatmaps would hide them otherwise).
+        """
         # Internal variables
         self.height_px = self.pitch_width*10*zoom_ratio
         self.width_px = self.pitch_length*10*zoom_ratio
 
+        key = (self.pitch_length, self.pitch_width, self.half, plot_corner_arcs, line_color, bg_color, zoom_ratio, arc_points, compact, lines_above)
+        if key not in self._base_figures:
+            if compact:
+                fig = self._draw_pitch_shapes(plot_corner_arcs, line_color, bg_color, arc_points, 'above' if lines_above else 'below')
+            else:
+                fig = self._draw_pitch(plot_corner_arcs, line_color, bg_color, arc_points)
+            self._base_figures[key] = fig.to_dict()
+
+        # The cached figure was validated when it was drawn, so skip validating the copy
+        fig = go.Figure(copy.deepcopy(self._base_figures[key]), _validate=False)
+
+        if show:
+            fig.show()
+        return fig
+
+
+    def _draw_pitch(self, plot_corner_arcs, line_color, bg_color, arc_points):
+        # Fig to update
+        fig = go.Figure()
+
         pitch_length_half = self.pitch_length/2 if not self.half else 0
         pitch_width_half = self.pitch_width/2
         corner_arc_radius = 1
@@ -62,7 +113,7 @@ class FootballPitch():
         # Corner arcs (ACABAR ELIMINANTHO)
         if plot_corner_arcs:
             for degrees in range(0, 360, 90):
-                theta = np.linspace(degrees*np.pi/180, (degrees+90)*np.pi/180, 5000)
+                theta = np.linspace(degrees*np.pi/180, (degrees+90)*np.pi/180, arc_points)
                 x = corner_arc_radius * np.cos(theta)
                 y = corner_arc_radius * np.sin(theta)
                 if degrees in [90, 180]:
@@ -154,7 +205,7 @@ class FootballPitch():
 
             # Penalty arc
             degree = 307 if goal_line_x == 0 else 127
-            theta = np.linspace(degree*np.pi/180, (degree+106)*np.pi/180, 5000)
+            theta = np.linspace(degree*np.pi/180, (degree+106)*np.pi/180, arc_points)
             x = penalty_circle_radius * np.cos(theta) + abs(goal_line_x-penalty_spot_dist)
             y = penalty_circle_radius * np.sin(theta) + pitch_width_half
             fig.add_trace(
@@ -169,6 +220,12 @@ class FootballPitch():
             fig.add_trace(trace)
 
         # Add final styles
+        self._style_layout(fig)
+
+        return fig
+
+
+    def _style_layout(self, fig):
         fig.update_layout(
             yaxis_range=[-self._vertical_margin, self.pitch_width + self._vertical_margin], 
             xaxis_range=[-self._horizontal_margin, self.pitch_length + self._horizontal_margin],
@@ -179,16 +236,100 @@ class FootballPitch():
             yaxis=dict(showgrid=False, visible=False)
         )
 
-        if show:
-            fig.show()
+
+    def _draw_pitch_shapes(self, plot_corner_arcs, line_color, bg_color, arc_points, layer='below'):
+        """
+        Same pitch as _draw_pitch, drawn with layout shapes on layer and a
+        template reduced to what shows on the pitch. The background always
+        goes below the traces
+        """
+        fig = go.Figure()
+
+        pitch_length_half = self.pitch_length/2 if not self.half else 0
+        pitch_width_half = self.pitch_width/2
+        corner_arc_radius = 1
+
+        centre_circle_radius = 9.15
+
+        goal = 7.32
+        goal_area_width = goal + (5.5*2)
+        goal_area_length = 5.5
+        penalty_area_width = goal_area_width + (11*2)
+        penalty_area_length = goal_area_length + 11
+        penalty_spot_dist = 11
+        penalty_circle_radius = 9.15
+
+        # Marker sizes of _draw_pitch (pixels) as radius in meters
+        meters_per_px = self.pitch_length / self.width_px
+        centre_spot_radius = 7/2 * meters_per_px
+        penalty_spot_radius = 5/2 * meters_per_px
+
+        line = dict(color=line_color, width=2)
+
+        def rect(x0, y0, x1, y1, **kwargs):
+            fig.add_shape(type='rect', x0=x0, y0=y0, x1=x1, y1=y1, line=line, layer=layer, **kwargs)
+
+        def circle(x, y, radius, **kwargs):
+            fig.add_shape(
+                type='circle', x0=x-radius, y0=y-radius, x1=x+radius, y1=y+radius, line=line, layer=layer, **kwargs
+            )
+
+        def arc(x, y, radius, start_degrees, end_degrees):
+            theta = np.linspace(start_degrees*np.pi/180, end_degrees*np.pi/180, arc_points)
+            points = np.round(np.column_stack([radius*np.cos(theta) + x, radius*np.sin(theta) + y]), self.COMPACT_DECIMALS)
+            path = 'M' + 'L'.join(f'{point[0]:g},{point[1]:g}' for point in points)
+            fig.add_shape(type='path', path=path, line=line, layer=layer)
+
+        # The pitch itself
+        fig.add_shape(
+            type='rect', x0=0, y0=0, x1=self.pitch_length, y1=self.pitch_width, line=line, fillcolor=bg_color, layer='below'
+        )
+        if layer != 'below':
+            rect(0, 0, self.pitch_length, self.pitch_width)
+
+        # Corner arcs
+        if plot_corner_arcs:
+            for degrees in range(0, 360, 90):
+                x = self.pitch_length if degrees in [90, 180] else 0
+                y = self.pitch_width if degrees in [180, 270] else 0
+                arc(x, y, corner_arc_radius, degrees, degrees+90)
+
+        # Half-way line, centre spot and circle
+        fig.add_shape(
+            type='line', x0=pitch_length_half, y0=0, x1=pitch_length_half, y1=self.pitch_width, line=line, layer=layer
+        )
+        circle(pitch_length_half, pitch_width_half, centre_spot_radius, fillcolor=line_color)
+        circle(pitch_length_half, pitch_width_half, centre_circle_radius)
+
+        # Goal and penalty areas
+        goal_lines_to_plot = [0, self.pitch_length] if not self.half else [self.pitch_length]
+        for goal_line_x in goal_lines_to_plot:
+            rect(
+                goal_line_x, pitch_width_half - (goal_area_width/2),
+                abs(goal_line_x-goal_area_length), pitch_width_half + (goal_area_width/2)
+            )
+            circle(abs(goal_line_x-penalty_spot_dist), pitch_width_half, penalty_spot_radius, fillcolor=line_color)
+            rect(
+                goal_line_x, pitch_width_half - (penalty_area_width/2),
+                abs(goal_line_x-penalty_area_length), pitch_width_half + (penalty_area_width/2)
+            )
+            degree = 307 if goal_line_x == 0 else 127
+            arc(abs(goal_line_x-penalty_spot_dist), pitch_width_half, penalty_circle_radius, degree, degree+106)
+
+        self._style_layout(fig)
+        fig.update_layout(template=_compact_template())
+
         return fig
 
     
-    def plot_heatmap(self, data: np.ndarray, zoom_ratio=1, **kwargs):
+    def plot_heatmap(self, data: np.ndarray, zoom_ratio=1, arc_points=ARC_POINTS, compact=False, **kwargs):
         if "colorscale" not in kwargs:
             kwargs["colorscale"] = px.colors.sequential.Reds[:1] + px.colors.sequential.Sunsetdark
 
-        fig = self.plot_pitch(show=False, line_color='black', bg_color='rgba(0,0,0,0)', zoom_ratio=zoom_ratio)
+        fig = self.plot_pitch(
+            show=False, line_color='black', bg_color='rgba(0,0,0,0)', zoom_ratio=zoom_ratio, arc_points=arc_points,
+            compact=compact, lines_above=True
+        )
         dx = self.pitch_length/ data.shape[1]
         dy = self.pitch_width / data.shape[0]
         
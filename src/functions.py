@@ -1,12 +1,31 @@
 #from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import time
 import warnings
 warnings.filterwarnings("ignore")
 
-#import numpy as np
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 #from plotly.subplots import make_subplots
 #import plotly.graph_objects as go
-from statsbombpy import sb
+
+from src.classes import FootballPitch
+from src.sources import DataSource, default_source
+
+logger = logging.getLogger(__name__)
+
+FETCH_WORKERS = int(os.environ.get('STATSBOMB_FETCH_WORKERS', 8))
+FETCH_RETRIES = 3
+
+# Compact dtypes of the frames, see compact_frame and add_pitch_coordinates
+CATEGORICAL_COLUMNS = ['match_date', 'player', 'team', 'pass_recipient', 'shot_outcome', 'shot_type']
+INTEGER_DTYPES = {'match_id': np.int32, 'minute': np.int16}
+COORDINATE_DTYPE = np.float32
+# Pitch coordinates are kept in centimetres, float32 rounding can't move them
+PITCH_DECIMALS = 2
 
 player_name_mapper = {
     'Luis Alberto Suárez Díaz': 'Luis Suárez',
@@ -37,14 +56,79 @@ def minute_string_to_float(x, hours=False):
         return int(x.split(':')[0]) + int(x.split(':')[1])/60
 
 
-def prepare_team_data(team: str = 'Barcelona'):
+def timestamp_to_minutes(timestamps: pd.Series):
+    """
+    Vectorized minute_string_to_float(x, hours=True) (e.g. '00:45:30.000' -> 45.5)
+    """
+    parts = timestamps.str.split(':', expand=True)
+    return parts[0].astype(int)*60 + parts[1].astype(int) + parts[2].astype(float)/60
+
+
+def normalize_events(all_events: pd.DataFrame, team: str):
     """
-    Returns three dataframes regarding all_events, shots and assists
+    Adds the derived columns (minutes, x, y, time, float_time) to the raw
+    events of a team using columnar operations only
     """
+    # Duration of every match, taken from the team's Half End timestamps
+    half_ends = all_events[(all_events['type'] == 'Half End') & (all_events['team'] == team)]
+    match_minutes = timestamp_to_minutes(half_ends['timestamp']).groupby(half_ends['match_id']).sum()
+    all_events['minutes'] = all_events['match_id'].map(match_minutes).fillna(0).to_numpy()
+
+    # Split location into x and y, events without location keep NaN
+    has_location = all_events['location'].notna().to_numpy()
+    coordinates = np.full((len(all_events), 2), np.nan)
+    coordinates[has_location] = np.array(all_events['location'][has_location].tolist(), dtype=float)
+    all_events['x'] = coordinates[:, 0]
+    all_events['y'] = coordinates[:, 1]
+
+    all_events['time'] = (
+        all_events['minute'].astype(str).str.zfill(2) + ':' + all_events['second'].astype(str).str.zfill(2)
+    )
+    all_events['float_time'] = all_events.minute + (all_events.second/60)
     
-    competition_row = sb.competitions()[
-        (sb.competitions()['competition_name'] == 'La Liga') 
-        & (sb.competitions()['season_name'] == '2015/2016')
+    #Standardize shots (origin on the bottom-left corner)
+    all_events['y'] = 80 - all_events['y']
+
+    return all_events
+
+
+def fetch_events(match_id, retries: int = FETCH_RETRIES, source: DataSource = None):
+    """
+    Downloads the events of a match, retrying with exponential backoff
+    """
+    source = source or default_source()
+    for attempt in range(retries + 1):
+        try:
+            return source.events(match_id)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            logger.warning('Fetching match %s failed (%s), retrying', match_id, e)
+            time.sleep(2 ** attempt)
+
+
+def fetch_match_events(
+        match_ids, max_workers: int = FETCH_WORKERS, retries: int = FETCH_RETRIES, source: DataSource = None
+    ):
+    """
+    Downloads the events of every match through a bounded thread pool.
+    Returns a list of dataframes in the same order as match_ids
+    """
+    source = source or default_source()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda match_id: fetch_events(match_id, retries, source), match_ids))
+
+
+def competition_matches(competition: str, season: str, source: DataSource = None):
+    """
+    Returns the matches of a competition and season as listed by source
+    """
+    source = source or default_source()
+    
+    competitions = source.competitions()
+    competition_row = competitions[
+        (competitions['competition_name'] == competition) 
+        & (competitions['season_name'] == season)
     ]
     competition_id = pd.unique(
         competition_row['competition_id']
@@ -53,34 +137,61 @@ def prepare_team_data(team: str = 'Barcelona'):
         competition_row['season_id']
     )[0]
 
-    matches = sb.matches(competition_id=competition_id, season_id=season_id)
+    return source.matches(competition_id, season_id)
+
+
+def prepare_team_data(
+        team: str = 'Barcelona', 
+        competition: str = 'La Liga', 
+        season: str = '2015/2016', 
+        max_workers: int = FETCH_WORKERS,
+        source: DataSource = None
+    ):
+    """
+    Returns three dataframes regarding all_events, shots and assists.
+    Data is read from source (see src.sources), by default the statsbomb API
+    or the local open-data copy in STATSBOMB_DATA_DIR
+    """
+    source = source or default_source()
+    matches = competition_matches(competition, season, source)
 
     team_matches = matches[(matches['home_team'] == team) | (matches['away_team'] == team)]
 
-    all_events = None
-
-    for match_id in pd.unique(team_matches['match_id']):
-        match_events = sb.events(match_id=match_id)
-        match_events['minutes'] = match_events[
-            (match_events['type'] == 'Half End') 
-            & (match_events['team'] == team)
-        ]['timestamp'].apply(lambda x: minute_string_to_float(x, True)).sum()
-        
-        if all_events is None:
-            all_events = match_events.copy()
-        else:
-            all_events = pd.concat([all_events, match_events])
+    all_events = pd.concat(
+        fetch_match_events(pd.unique(team_matches['match_id']), max_workers, source=source)
+    )
+    return split_team_events(all_events, matches, team)
+
+
+def prepare_match_data(
+        match_id: int,
+        team: str = 'Barcelona', 
+        competition: str = 'La Liga', 
+        season: str = '2015/2016', 
+        source: DataSource = None
+    ):
+    """
+    Same as prepare_team_data for a single match of team
+    """
+    source = source or default_source()
+    matches = competition_matches(competition, season, source)
+
+    match = matches[matches['match_id'] == match_id]
+    if not ((match['home_team'] == team) | (match['away_team'] == team)).any():
+        raise ValueError(f'{team} did not play match {match_id} of {competition} {season}')
+
+    return split_team_events(fetch_events(match_id, source=source), match, team)
 
+
+def split_team_events(all_events: pd.DataFrame, matches: pd.DataFrame, team: str):
+    """
+    Splits the raw events of the matches of team into the compact all_events,
+    shots and assists frames
+    """
     # events
     all_events = all_events.merge(matches[['match_id', 'match_date']], on='match_id')
     all_events.replace({'player': player_name_mapper}, inplace=True)
-    all_events['x'] = all_events['location'].apply(lambda x: x[0] if not isinstance(x, float) else x)
-    all_events['y'] = all_events['location'].apply(lambda x: x[1] if not isinstance(x, float) else x)
-    all_events['time'] =  all_events.apply(lambda x: f"{str(x['minute']).zfill(2)}:{str(x['second']).zfill(2)}", axis=1)
-    all_events['float_time'] = all_events.minute + (all_events.second/60)
-    
-    #Standardize shots (origin on the bottom-left corner)
-    all_events['y'] = 80 - all_events['y']
+    all_events = normalize_events(all_events, team)
 
     # shots
     shots = all_events.loc[
@@ -97,74 +208,197 @@ def prepare_team_data(team: str = 'Barcelona'):
 
     # goals
     assists = all_events[all_events['pass_shot_assist'] == True]
+    assists = assists[[
+        'match_id', 'x', 'y', 'float_time', 'player', 'team', 'pass_recipient', 'minutes'
+    ]]
 
-    return all_events[['match_id', 'match_date', 'player', 'x', 'y', 'location', 'minute', 'minutes', 'float_time']], shots, assists
+    all_events = all_events[['match_id', 'match_date', 'player', 'x', 'y', 'minute', 'minutes', 'float_time']]
+    return compact_frame(all_events), compact_frame(shots), compact_frame(assists)
 
 
-def get_player_shots(player:str, shots, pitch=None):
+def compact_frame(frame: pd.DataFrame):
+    """
+    Returns frame with the compact dtypes: categorical strings, narrow
+    integers and without the location lists (x and y hold them). StatsBomb's
+    x and y stay float64, the pitch coordinates are derived from them (see
+    add_pitch_coordinates for their float32 columns)
+    """
+    frame = frame.drop(columns='location', errors='ignore')
+    dtypes = {}
+    for column in frame.columns:
+        if column in CATEGORICAL_COLUMNS and not isinstance(frame[column].dtype, pd.CategoricalDtype):
+            dtypes[column] = 'category'
+        elif column in INTEGER_DTYPES:
+            dtypes[column] = INTEGER_DTYPES[column]
+    return frame.astype(dtypes)
 
-    ## Scale x to dimensions
-    #shots['x'] = (shots['x'] - 0) / (shots['x'].max() - 0) * (dimensions.pitch_length_metres - 0) + 0
-    #shots['y'] = (shots['y'] - 0) / (shots['y'].max() - 0) * (dimensions.pitch_width_metres - 0) + 0
 
-    if pitch is not None:
-        shots['x'] = shots['x'] / (120 - 0) * (pitch.pitch_length if not pitch.half else pitch.pitch_length*2)
-        shots['y'] = shots['y'] / (80 - 0) * pitch.pitch_width
-        #shots['y'] =  pitch.pitch_width - shots['y']
+def concat_frames(frames):
+    """
+    Concatenates compact frames copying every column once, categorical
+    columns stay categorical (with the union of the categories, sorted like
+    compact_frame sorts them)
+    """
+    frames = list(frames)
+    columns = {}
+    for column in frames[0].columns:
+        if isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+            columns[column] = union_categoricals([frame[column] for frame in frames], sort_categories=True)
+        else:
+            columns[column] = np.concatenate([frame[column].to_numpy() for frame in frames])
 
-        shots['x'] -= pitch.pitch_length if pitch.half else 0
+    # Row labels only matter when they are ids (shots)
+    if all(isinstance(frame.index, pd.RangeIndex) for frame in frames):
+        index = pd.RangeIndex(sum(len(frame) for frame in frames))
+    else:
+        index = frames[0].index.append([frame.index for frame in frames[1:]])
+    return pd.DataFrame(columns, index=index, copy=False)
 
-    if player != 'All players':
-        return shots[shots['player'] == player]
-    return shots
 
+def pitch_cells(x, y, length: float, width: float, cell_size: float = 3):
+    """
+    Cell of every point on a length x width pitch, the one whose corner is the
+    nearest multiple of cell_size, -1 outside the pitch (or without location).
+    Returns the cells and the (rows, cols) of the grid, rows along the width
+    """
+    n_cols = int(np.ceil(int(length) / cell_size))
+    n_rows = int(np.ceil(int(width) / cell_size))
 
-def get_player_goals(player:str, goals: pd.DataFrame, pitch=None):
+    cols = np.rint(np.asarray(x, dtype=float) / cell_size)
+    rows = np.rint(np.asarray(y, dtype=float) / cell_size)
+    inside = (cols >= 0) & (cols < n_cols) & (rows >= 0) & (rows < n_rows)
 
-    ## Scale x to dimensions
-    if pitch is not None:
-        goals['x'] = goals['x'] / (120 - 0) * (pitch.pitch_length if not pitch.half else pitch.pitch_length*2)
-        goals['y'] = goals['y'] / (80 - 0) * pitch.pitch_width
-        #goals['y'] =  pitch.pitch_width - goals['y']
+    cells = np.full(len(cols), -1)
+    cells[inside] = rows[inside].astype(int) * n_cols + cols[inside].astype(int)
+    return cells, (n_rows, n_cols)
+
+
+def bin_events(x, y, length: float, width: float, cell_size: float = 3):
+    """
+    Counts the events on every cell of a length x width pitch (see
+    pitch_cells) in a single pass. Returns an array with one row per cell
+    along the width
+    """
+    cells, shape = pitch_cells(x, y, length, width, cell_size)
+    return np.bincount(cells[cells >= 0], minlength=shape[0] * shape[1]).reshape(shape)
 
-        goals['x'] -= pitch.pitch_length if pitch.half else 0
+
+def count_by_bucket(frame: pd.DataFrame, bucket_minutes: float = 15):
+    """
+    Counts the rows of every player on each bucket of bucket_minutes (rows go
+    to the nearest multiple of it) with a single groupby. Returns the counts
+    indexed by (player, bucket) and the team average per bucket
+    """
+    buckets = bucket_minutes * (frame['float_time'] / bucket_minutes).round()
+    counts = frame['minutes'].groupby([frame['player'], buckets], observed=True).count()
+    counts.index.names = ['player', 'float_time']
+
+    n_players = max(frame['player'].nunique(dropna=False), 1)
+    team = counts.groupby(level='float_time').sum() / n_players
+    return counts, team
+
+
+def parse_range(value):
+    """
+    Translate a range slider value into a tuple of ints (e.g. '[1, 38]' -> (1, 38))
+    """
+    if isinstance(value, str):
+        value = value[1:-1].split(',')
+    return tuple(int(v) for v in value)
+
+
+def pitch_columns(pitch):
+    """
+    Names of the columns holding x and y already scaled to pitch
+    (e.g. ('x_105x68_half', 'y_105x68_half') for the half of a 105x68 pitch)
+    """
+    length = pitch.pitch_length*2 if pitch.half else pitch.pitch_length
+    suffix = f'{length:g}x{pitch.pitch_width:g}' + ('_half' if pitch.half else '')
+    return f'x_{suffix}', f'y_{suffix}'
+
+
+def pitch_coordinates(frame: pd.DataFrame, pitch):
+    """
+    Returns x and y of frame (statsbomb's 120x80 units) scaled to the pitch dimensions
+    """
+    x = frame['x'].astype(float) / (120 - 0) * (pitch.pitch_length if not pitch.half else pitch.pitch_length*2)
+    y = frame['y'].astype(float) / (80 - 0) * pitch.pitch_width
+    #y =  pitch.pitch_width - y
+
+    x -= pitch.pitch_length if pitch.half else 0
+    return x, y
+
+
+def add_pitch_coordinates(
+        frame: pd.DataFrame,
+        pitch_length: float = FootballPitch.PITCH_LENGTH_METERS,
+        pitch_width: float = FootballPitch.PITCH_WIDTH_METERS
+    ):
+    """
+    Materializes the full and half pitch coordinates of frame for a pitch of
+    the given dimensions, so the get_player_* helpers don't rescale per request
+    """
+    for half in [False, True]:
+        pitch = FootballPitch(pitch_length, pitch_width, half=half)
+        x_column, y_column = pitch_columns(pitch)
+        x, y = pitch_coordinates(frame, pitch)
+        frame[x_column] = x.round(PITCH_DECIMALS).astype(COORDINATE_DTYPE)
+        frame[y_column] = y.round(PITCH_DECIMALS).astype(COORDINATE_DTYPE)
+    return frame
+
+
+def _to_pitch(frame: pd.DataFrame, pitch):
+    """
+    Returns frame with x and y in pitch dimensions, without modifying frame
+    """
+    if pitch is None:
+        return frame
+
+    x_column, y_column = pitch_columns(pitch)
+    if x_column in frame.columns:
+        return frame.assign(x=frame[x_column].astype(float), y=frame[y_column].astype(float))
+
+    x, y = pitch_coordinates(frame, pitch)
+    return frame.assign(x=x, y=y)
+
+
+def get_player_shots(player:str, shots, pitch=None):
 
     if player != 'All players':
-        return goals[goals['player'] == player]
+        shots = shots[shots['player'] == player]
 
-    return goals
+    ## Scale x to dimensions
+    return _to_pitch(shots, pitch)
 
 
-def get_player_events(player:str, events: pd.DataFrame, pitch=None):
+def get_player_goals(player:str, goals: pd.DataFrame, pitch=None):
+
+    if player != 'All players':
+        goals = goals[goals['player'] == player]
 
     ## Scale x to dimensions
-    if pitch is not None:
-        events['x'] = events['x'] / (120 - 0) * (pitch.pitch_length if not pitch.half else pitch.pitch_length*2)
-        events['y'] = events['y'] / (80 - 0) * pitch.pitch_width
-        #events['y'] =  pitch.pitch_width - events['y']
+    return _to_pitch(goals, pitch)
 
-        events['x'] -= pitch.pitch_length if pitch.half else 0
+
+def get_player_events(player:str, events: pd.DataFrame, pitch=None):
 
     if player != 'All players':
-        return events[events['player'] == player]
+        events = events[events['player'] == player]
 
-    return events
+    ## Scale x to dimensions
+    return _to_pitch(events, pitch)
     
     
 def get_player_asists(player:str, assists: pd.DataFrame, pitch=None):
 
-    ## Scale x to dimensions
-    if pitch is not None:
-        assists['x'] = assists['x'] / (120 - 0) * (pitch.pitch_length if not pitch.half else pitch.pitch_length*2)
-        assists['y'] = assists['y'] / (80 - 0) * pitch.pitch_width
-        #assists['y'] =  pitch.pitch_width - assists['y']
+    if player != 'All players':
+        assists = assists[assists['player'] == player]
 
-        assists['x'] -= pitch.pitch_length if pitch.half else 0
+    ## Scale x to dimensions
+    assists = _to_pitch(assists, pitch)
 
+    if pitch is not None:
         # Remove first-half assists
         assists = assists[assists['x'] >= 0]
 
-    if player != 'All players':
-        return assists[assists['player'] == player]
-
-    return assists
\ No newline at end of file
+    return assists
@@ -0,0 +1,120 @@
+"""
+Player images served as static files instead of inlined in callback responses.
+
+Images are read from IMG_DIR on request and sent with long cache headers.
+When a thumbnail with the same name exists in THUMBNAIL_DIR it is served
+instead. Generate the thumbnails (needs Pillow) with:
+
+    python -m src.images --size 150
+"""
+import argparse
+import logging
+import os
+import re
+
+from flask import send_from_directory
+from unidecode import unidecode
+
+from src.cache import CACHE_DIR
+from src.functions import player_name_mapper
+
+logger = logging.getLogger(__name__)
+
+IMG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'img')
+THUMBNAIL_DIR = os.path.join(CACHE_DIR, 'thumbnails')
+# Pixels of the longest side, the size the dashboard shows them at
+THUMBNAIL_SIZE = 150
+# Seconds browsers may keep an image without asking again
+IMG_MAX_AGE = 7 * 24 * 3600
+IMG_ROUTE = '/player-img/'
+
+
+def list_images(img_dir: str = IMG_DIR):
+    """
+    Returns the file names of the available player images (without reading them)
+    """
+    return sorted(os.listdir(img_dir))
+
+
+def normalize_name(name: str):
+    """
+    Key used to match player names and image files (e.g. 'Rafa Alcántara' -> 'rafaalcantara')
+    """
+    return unidecode(re.sub(r'\W+', '', name)).lower()
+
+
+def build_image_index(players, images=None, aliases: dict = player_name_mapper):
+    """
+    Maps every player to the file name of its image. A player matches the
+    image named after it or after any of its aliases (both the long and the
+    short names in aliases). Otherwise it takes the only image whose name
+    contains the player's, if there is exactly one.
+    Returns the index and the players left without image.
+    """
+    images = list_images() if images is None else images
+    by_key = {normalize_name(os.path.splitext(img)[0]): img for img in images}
+
+    names = {}
+    for long_name, short_name in aliases.items():
+        names.setdefault(long_name, []).append(short_name)
+        names.setdefault(short_name, []).append(long_name)
+
+    index, missing = {}, []
+    for player in players:
+        keys = [normalize_name(name) for name in [player] + names.get(player, [])]
+        matches = [by_key[key] for key in keys if key in by_key]
+        if not matches:
+            partial = {img for key in keys for stem, img in by_key.items() if key in stem}
+            matches = list(partial) if len(partial) == 1 else []
+
+        if matches:
+            index[player] = matches[0]
+        else:
+            missing.append(player)
+
+    return index, missing
+
+
+def register_image_route(server, route: str = IMG_ROUTE, img_dir: str = IMG_DIR, thumbnail_dir: str = THUMBNAIL_DIR):
+    """
+    Serves the player images on route, preferring the thumbnail of every image
+    """
+    def player_img(filename):
+        directory = thumbnail_dir if os.path.exists(os.path.join(thumbnail_dir, filename)) else img_dir
+        return send_from_directory(directory, filename, max_age=IMG_MAX_AGE)
+
+    server.add_url_rule(f'{route}<path:filename>', 'player_img', player_img)
+
+
+def make_thumbnails(size: int = THUMBNAIL_SIZE, img_dir: str = IMG_DIR, thumbnail_dir: str = THUMBNAIL_DIR):
+    """
+    Writes a copy of every image no bigger than size x size to thumbnail_dir
+    """
+    from PIL import Image
+
+    os.makedirs(thumbnail_dir, exist_ok=True)
+
+    for filename in list_images(img_dir):
+        with Image.open(os.path.join(img_dir, filename)) as img:
+            img.thumbnail((size, size))
+            img.save(os.path.join(thumbnail_dir, filename), optimize=True)
+        logger.info(
+            'Thumbnail %s: %d -> %d bytes', filename,
+            os.path.getsize(os.path.join(img_dir, filename)), os.path.getsize(os.path.join(thumbnail_dir, filename))
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the player image thumbnails')
+    parser.add_argument('--size', type=int, default=THUMBNAIL_SIZE, help='pixels of the longest side')
+    parser.add_argument('--img-dir', default=IMG_DIR)
+    parser.add_argument('--thumbnail-dir', default=THUMBNAIL_DIR)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    make_thumbnails(args.size, args.img_dir, args.thumbnail_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,386 @@
+"""
+Sorted index over the events, shots and assists frames.
+
+Rows are sorted once at load time by (player, matchday ordinal, float_time),
+so a player + matchday range + minute range query is a couple of
+searchsorted calls over that order instead of a boolean scan of the season.
+CumulativeXG keeps prefix sums of xG and goals per matchday, so cumulative
+series over any matchday range are a difference of two entries plus a slice.
+HeatmapCube keeps prefix sums of a player's event counts per pitch cell over
+matchdays and minutes, so any heatmap is a sum of four grids.
+"""
+import numpy as np
+import pandas as pd
+
+from src.functions import pitch_cells
+
+# Matchday ordinal and minute are packed in one sortable key as
+# ordinal * KEY_STRIDE + float_time, so it must exceed the longest match
+KEY_STRIDE = 1000
+
+
+class EventIndex():
+
+    def __init__(self, frame: pd.DataFrame, ordered_matchdays):
+        """
+        Indexes frame by player, position of its match in ordered_matchdays
+        and float_time. Rows of matches missing from ordered_matchdays are
+        left out of the index
+        """
+        self.n_matchdays = len(ordered_matchdays)
+        ordinals = frame['match_id'].map(
+            pd.Series(np.arange(self.n_matchdays), index=ordered_matchdays)
+        ).to_numpy()
+        indexed = np.flatnonzero(~np.isnan(ordinals))
+        keys = ordinals[indexed] * KEY_STRIDE + frame['float_time'].to_numpy()[indexed]
+
+        # Rows without player get -1 and only show up on 'All players'
+        codes, players = pd.factorize(frame['player'].to_numpy()[indexed], sort=True)
+        self.players = pd.Index(players)
+
+        # All players, sorted by key
+        order = np.argsort(keys, kind='stable')
+        self._positions = indexed[order]
+        self._keys = keys[order]
+
+        # Per player, sorted by (player, key)
+        order = np.lexsort((keys, codes))
+        self._player_positions = indexed[order]
+        self._player_keys = keys[order]
+        self._offsets = np.searchsorted(codes[order], np.arange(len(self.players) + 1))
+
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in [
+            self._positions, self._keys, self._player_positions, self._player_keys, self._offsets
+        ])
+
+
+    def query(self, player: str = 'All players', start: int = 0, stop: int = None, minute_range=None, ordered: bool = True):
+        """
+        Positions of the rows of player played in ordered_matchdays[start:stop]
+        and, if given, between minute_range[0]-1 and minute_range[1] (both
+        included). In frame order if ordered, otherwise in index order, which
+        saves sorting them when only counts are needed
+        """
+        if player == 'All players':
+            positions, keys = self._positions, self._keys
+        else:
+            code = self.players.get_indexer([player])[0]
+            if code < 0:
+                return np.empty(0, dtype=np.intp)
+            block = slice(self._offsets[code], self._offsets[code+1])
+            positions, keys = self._player_positions[block], self._player_keys[block]
+
+        matchdays = np.arange(start, min(stop if stop is not None else self.n_matchdays, self.n_matchdays))
+        if not len(matchdays):
+            return np.empty(0, dtype=np.intp)
+
+        if minute_range is None:
+            # Every minute of the range, one contiguous slice
+            lower = np.searchsorted(keys, matchdays[0] * KEY_STRIDE, 'left')
+            upper = np.searchsorted(keys, (matchdays[-1] + 1) * KEY_STRIDE, 'left')
+            positions = positions[lower:upper]
+            return np.sort(positions) if ordered else positions
+
+        # One contiguous slice per matchday
+        base = matchdays * KEY_STRIDE
+        lower = np.searchsorted(keys, base + minute_range[0] - 1, 'left')
+        upper = np.searchsorted(keys, base + minute_range[1], 'right')
+        positions = positions[_concat_ranges(lower, upper)]
+        return np.sort(positions) if ordered else positions
+
+
+    def extend(self, frame: pd.DataFrame, start: int):
+        """
+        Returns a new index with the rows of frame, one match played after
+        every indexed one, appended at positions start onwards. Only the
+        rows of frame are sorted, the existing order is copied as it is
+        """
+        ordinal = self.n_matchdays
+        positions = start + np.arange(len(frame))
+        keys = ordinal * KEY_STRIDE + frame['float_time'].to_numpy(dtype=float)
+        players = frame['player'].to_numpy(dtype=object)
+
+        index = object.__new__(EventIndex)
+        index.n_matchdays = self.n_matchdays + 1
+        index.players = self.players.union(pd.Index(players).dropna().unique())
+
+        # Keys of the new match go after every indexed one
+        order = np.argsort(keys, kind='stable')
+        index._positions = np.concatenate([self._positions, positions[order]])
+        index._keys = np.concatenate([self._keys, keys[order]])
+
+        # Each new row goes to the end of its player's block
+        (index._player_positions, index._player_keys), index._offsets = _insert_in_blocks(
+            self.players, self._offsets, players, keys, [self._player_positions, self._player_keys], [positions, keys]
+        )
+        return index
+
+
+class CumulativeXG():
+
+    def __init__(self, shots: pd.DataFrame, ordered_matchdays):
+        """
+        Prefix sums over the matchday ordinals of the team's average xG (xG
+        of the match over the players that shot in it) and, per player, of
+        xG and goals on the matchdays they shot. Shots of matches missing from
+        ordered_matchdays are left out
+        """
+        self.n_matchdays = len(ordered_matchdays)
+        ordinals = shots['match_id'].map(
+            pd.Series(np.arange(self.n_matchdays), index=ordered_matchdays)
+        ).to_numpy()
+        indexed = ~np.isnan(ordinals)
+        ordinals = ordinals[indexed].astype(np.intp)
+        xg = np.nan_to_num(shots['shot_statsbomb_xg'].to_numpy(dtype=float)[indexed])
+        goals = shots['goal'].to_numpy(dtype=int)[indexed]
+        codes, players = pd.factorize(shots['player'].to_numpy()[indexed], sort=True)
+        self.players = pd.Index(players)
+
+        # Team, one entry per matchday (shots without player count for xG only)
+        n_shots = np.bincount(ordinals, minlength=self.n_matchdays)
+        shooters = np.unique(ordinals[codes >= 0] * (len(players) + 1) + codes[codes >= 0]) // (len(players) + 1)
+        n_players = np.bincount(shooters, minlength=self.n_matchdays)
+        team_xg = np.bincount(ordinals, xg, minlength=self.n_matchdays)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            team_avg_xg = np.where(n_shots > 0, team_xg / n_players, 0)
+        self._team_matchdays = np.flatnonzero(n_shots)
+        self._team_cum_xg = np.concatenate([[0], np.cumsum(team_avg_xg)])
+
+        # Per player, one entry per (player, matchday with shots) sorted by
+        # both, with the sums since the first entry of the player
+        keys = codes[codes >= 0] * self.n_matchdays + ordinals[codes >= 0]
+        keys, inverse = np.unique(keys, return_inverse=True)
+        entry_codes = keys // max(self.n_matchdays, 1)
+        self._player_matchdays = keys % max(self.n_matchdays, 1)
+        self._player_cum_xg = pd.Series(
+            np.bincount(inverse, xg[codes >= 0], minlength=len(keys))
+        ).groupby(entry_codes).cumsum().to_numpy()
+        self._player_cum_goals = pd.Series(
+            np.bincount(inverse, goals[codes >= 0], minlength=len(keys)).astype(int)
+        ).groupby(entry_codes).cumsum().to_numpy()
+        self._offsets = np.searchsorted(entry_codes, np.arange(len(players) + 1))
+
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in [
+            self._team_matchdays, self._team_cum_xg, self._player_matchdays,
+            self._player_cum_xg, self._player_cum_goals, self._offsets
+        ])
+
+
+    def team(self, start: int = 0, stop: int = None, matchdays=None):
+        """
+        Cumulative team's average xG since ordered_matchdays[start], on every
+        matchday of ordered_matchdays[start:stop] with shots (or on matchdays)
+        """
+        if matchdays is None:
+            matchdays = self._team_matchdays[
+                np.searchsorted(self._team_matchdays, start):np.searchsorted(self._team_matchdays, self._stop(stop))
+            ]
+        return self._team_cum_xg[matchdays + 1] - self._team_cum_xg[start]
+
+
+    def player(self, player: str, start: int = 0, stop: int = None):
+        """
+        Matchdays of ordered_matchdays[start:stop] player shot in, with the
+        cumulative xG and goals since ordered_matchdays[start]
+        """
+        code = self.players.get_indexer([player])[0]
+        if code < 0:
+            return np.empty(0, dtype=np.intp), np.empty(0), np.empty(0, dtype=int)
+
+        # Entries of the player are self._offsets[code]:self._offsets[code+1]
+        first = self._offsets[code]
+        matchdays = self._player_matchdays[first:self._offsets[code+1]]
+        lower = first + np.searchsorted(matchdays, start)
+        upper = first + np.searchsorted(matchdays, self._stop(stop))
+
+        base_xg = self._player_cum_xg[lower-1] if lower > first else 0
+        base_goals = self._player_cum_goals[lower-1] if lower > first else 0
+        return (
+            self._player_matchdays[lower:upper],
+            self._player_cum_xg[lower:upper] - base_xg,
+            self._player_cum_goals[lower:upper] - base_goals
+        )
+
+
+    def extend(self, shots: pd.DataFrame):
+        """
+        Returns new sums with the shots of one match played after every
+        summed one. Costs a copy of the arrays, nothing is summed again
+        """
+        ordinal = self.n_matchdays
+        xg = np.nan_to_num(shots['shot_statsbomb_xg'].to_numpy(dtype=float))
+        goals = shots['goal'].to_numpy(dtype=int)
+        players = shots['player'].to_numpy(dtype=object)
+
+        cumulative = object.__new__(CumulativeXG)
+        cumulative.n_matchdays = self.n_matchdays + 1
+        cumulative.players = self.players.union(pd.Index(players).dropna().unique())
+
+        # Team, same average as __init__ over the players of the match
+        n_players = pd.Index(players).dropna().nunique()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            team_avg_xg = np.float64(xg.sum()) / n_players if len(shots) else 0
+        cumulative._team_matchdays = (
+            np.append(self._team_matchdays, ordinal) if len(shots) else self._team_matchdays.copy()
+        )
+        cumulative._team_cum_xg = np.append(self._team_cum_xg, self._team_cum_xg[-1] + team_avg_xg)
+
+        # Per player, one entry for the match added to the last one of the player
+        match_players = pd.Index(players).dropna().unique().sort_values()
+        sums = pd.DataFrame({'xg': xg, 'goals': goals}).groupby(pd.Index(players, name='player')).sum()
+        sums = sums.reindex(match_players)
+        codes = self.players.get_indexer(match_players)
+        last = np.where(codes >= 0, self._offsets[codes + 1] - 1, -1)
+        has_entries = (codes >= 0) & (last >= self._offsets[np.maximum(codes, 0)])
+        cum_xg = sums['xg'].to_numpy() + np.where(has_entries, self._player_cum_xg[last], 0)
+        cum_goals = sums['goals'].to_numpy() + np.where(has_entries, self._player_cum_goals[last], 0)
+
+        (
+            cumulative._player_matchdays, cumulative._player_cum_xg, cumulative._player_cum_goals
+        ), cumulative._offsets = _insert_in_blocks(
+            self.players, self._offsets, match_players.to_numpy(dtype=object), None,
+            [self._player_matchdays, self._player_cum_xg, self._player_cum_goals],
+            [np.full(len(match_players), ordinal, dtype=self._player_matchdays.dtype), cum_xg, cum_goals]
+        )
+        return cumulative
+
+
+    def _stop(self, stop: int = None):
+        return min(stop if stop is not None else self.n_matchdays, self.n_matchdays)
+
+
+class HeatmapCube():
+
+    def __init__(
+            self, events: pd.DataFrame, ordered_matchdays, length: float, width: float, cell_size: float = 3,
+            minutes=()
+        ):
+        """
+        Prefix sums of the events (x and y already on a length x width pitch)
+        per cell of cell_size, over the matchday ordinals they were played on
+        and over cuts of float_time. The cuts are those of the minute ranges
+        EventIndex.query takes with bounds in minutes, so those are summed and
+        the rest (query returns None) must be binned from the events.
+        Only the matchdays with events get an entry
+        """
+        self.n_matchdays = len(ordered_matchdays)
+        ordinals = events['match_id'].map(
+            pd.Series(np.arange(self.n_matchdays), index=ordered_matchdays)
+        ).to_numpy()
+        cells, self.shape = pitch_cells(events['x'], events['y'], length, width, cell_size)
+        indexed = ~np.isnan(ordinals) & (cells >= 0)
+        ordinals, cells = ordinals[indexed].astype(np.intp), cells[indexed]
+        float_time = events['float_time'].to_numpy(dtype=float)[indexed]
+
+        # A minute range [first-1, last] is the rows under the cut (last, <=)
+        # and not under (first-1, <), cuts are sorted so every one holds the
+        # rows of the previous ones. Slot 0 holds no row and the last one all
+        lower = sorted({minute - 1 for minute in minutes})
+        upper = sorted({minute for minute in minutes} | {np.inf})
+        cuts = sorted([(t, 0) for t in lower] + [(t, 1) for t in upper])
+        self._lower = {t + 1: cuts.index((t, 0)) + 1 for t in lower}
+        self._upper = {t: cuts.index((t, 1)) + 1 for t in upper}
+
+        # First cut holding each row, the ones before it exclude it
+        slots = 1 + np.searchsorted(lower, float_time, 'right') + np.searchsorted(upper, float_time, 'left')
+
+        self._matchdays, local = np.unique(ordinals, return_inverse=True)
+        n_cells = self.shape[0] * self.shape[1]
+        shape = (len(self._matchdays), len(cuts) + 1, n_cells)
+        counts = np.bincount(
+            (local * shape[1] + slots) * n_cells + cells, minlength=int(np.prod(shape))
+        ).reshape(shape)
+
+        # Smallest dtype the season total fits in, queries sum in int
+        dtype = np.uint16 if len(cells) < np.iinfo(np.uint16).max else np.uint32
+        self._counts = np.zeros((shape[0] + 1,) + shape[1:], dtype=dtype)
+        np.cumsum(np.cumsum(counts, axis=1), axis=0, out=self._counts[1:])
+
+
+    @staticmethod
+    def estimate_nbytes(n_events: int, n_matchdays: int, length: float, width: float, cell_size: float = 3, minutes=()):
+        """
+        Upper bound of nbytes for a cube of n_events over n_matchdays
+        """
+        _, (n_rows, n_cols) = pitch_cells([], [], length, width, cell_size)
+        n_cuts = len({minute - 1 for minute in minutes}) + len({minute for minute in minutes} | {np.inf})
+        itemsize = 2 if n_events < np.iinfo(np.uint16).max else 4
+        return (n_matchdays + 1) * (n_cuts + 1) * n_rows * n_cols * itemsize + n_matchdays * 8
+
+
+    @property
+    def nbytes(self):
+        return self._matchdays.nbytes + self._counts.nbytes
+
+
+    def query(self, start: int = 0, stop: int = None, minute_range=None):
+        """
+        Counts per cell (rows along the width) of the events played in
+        ordered_matchdays[start:stop] and, if given, between minute_range[0]-1
+        and minute_range[1] (both included). None when minute_range has a
+        bound the cube wasn't built for
+        """
+        if minute_range is None:
+            lower, upper = 0, self._upper[np.inf]
+        elif minute_range[0] in self._lower and minute_range[1] in self._upper:
+            lower, upper = self._lower[minute_range[0]], self._upper[minute_range[1]]
+        else:
+            return None
+
+        stop = min(stop if stop is not None else self.n_matchdays, self.n_matchdays)
+        first = np.searchsorted(self._matchdays, start)
+        last = max(np.searchsorted(self._matchdays, stop), first)
+        counts = self._counts
+        grid = counts[last, upper].astype(int) - counts[first, upper] - counts[last, lower] + counts[first, lower]
+        return grid.reshape(self.shape)
+
+
+def _insert_in_blocks(players: pd.Index, offsets, new_players, keys, arrays, values):
+    """
+    Inserts values (one array per array of arrays) at the end of the blocks
+    of new_players, rows without player go before every block like in
+    EventIndex. New rows of a block are ordered by keys when given.
+    Returns the new arrays and offsets, players are the sorted union
+    """
+    new_players = np.asarray(new_players, dtype=object)
+    has_player = pd.notna(new_players)
+    all_players = players.union(pd.Index(new_players[has_player]).unique())
+
+    # Block position of every new row, the end of its player's block (or of
+    # the block of the previous player when it is new)
+    blocks = np.zeros(len(new_players), dtype=np.intp)
+    blocks[has_player] = players.searchsorted(new_players[has_player], side='right')
+    order = np.lexsort((keys, blocks)) if keys is not None else np.argsort(blocks, kind='stable')
+    where = offsets[blocks[order]]
+
+    inserted = [np.insert(array, where, value[order]) for array, value in zip(arrays, values)]
+
+    # Sizes of the blocks of every player of the union
+    codes = all_players.get_indexer(new_players[has_player])
+    sizes = np.bincount(codes, minlength=len(all_players))
+    sizes[all_players.get_indexer(players)] += np.diff(offsets)
+    new_offsets = np.concatenate([[offsets[0] + np.count_nonzero(~has_player)], sizes]).cumsum()
+    return inserted, new_offsets
+
+
+def _concat_ranges(lower, upper):
+    """
+    Vectorized np.concatenate([np.arange(l, u) for l, u in zip(lower, upper)])
+    """
+    non_empty = upper > lower
+    lower, upper = lower[non_empty], upper[non_empty]
+    if not len(lower):
+        return np.empty(0, dtype=np.intp)
+
+    # Steps of 1 inside each range and a jump to the next range's start
+    sizes = upper - lower
+    steps = np.ones(sizes.sum(), dtype=np.intp)
+    steps[0] = lower[0]
+    steps[np.cumsum(sizes)[:-1]] = lower[1:] - upper[:-1] + 1
+    return np.cumsum(steps)
@@ -0,0 +1,55 @@
+"""
+HTTP endpoint to ingest a new match into a running dashboard:
+
+    curl -X POST localhost:8050/ingest -H 'Authorization: Bearer <token>' \
+        -H 'Content-Type: application/json' \
+        -d '{"competition": "La Liga", "season": "2015/2016", "team": "Barcelona", "match_id": 266003}'
+
+Only registered when DASHBOARD_INGEST_TOKEN is set. The match is written to
+the cache, so other gunicorn workers read it on their next load of the
+partition (or restart), ingest it on each of them to show it right away.
+"""
+import hmac
+import os
+
+from flask import jsonify, request
+
+from src.store import Partition
+
+INGEST_TOKEN = os.environ.get('DASHBOARD_INGEST_TOKEN')
+
+
+def register_ingest_route(server, store, on_ingest=None, route: str = '/ingest', token: str = INGEST_TOKEN):
+    """
+    Serves POST route, adding a match to a partition of store (see
+    DataStore.ingest) and calling on_ingest(partition) afterwards
+    """
+    if not token:
+        return
+
+    def ingest():
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return jsonify(error='Invalid token'), 403
+
+        body = request.get_json(silent=True) or {}
+        try:
+            partition = Partition(body['competition'], body['season'], body['team'])
+            match_id = int(body['match_id'])
+        except (KeyError, TypeError, ValueError):
+            return jsonify(error='Expected competition, season, team and match_id'), 400
+
+        try:
+            data = store.ingest(partition, match_id)
+        except KeyError:
+            return jsonify(error=f'Unknown partition {"/".join(partition)}'), 404
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+
+        if on_ingest is not None:
+            on_ingest(partition)
+        return jsonify(
+            match_id=match_id, loaded=data is not None,
+            matchdays=len(data.ordered_matchdays) if data is not None else None
+        )
+
+    server.add_url_rule(route, 'ingest', ingest, methods=['POST'])
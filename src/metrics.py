@@ -0,0 +1,98 @@
+"""
+Prometheus metrics of the dashboard, exposed on /metrics.
+
+Every update is a constant time counter/histogram update, nothing is
+computed until /metrics is scraped. Response sizes are read from the
+responses Dash already serialized, so figures are never serialized twice.
+
+Under gunicorn set PROMETHEUS_MULTIPROC_DIR to an empty directory so the
+metrics of every worker are aggregated.
+"""
+from functools import wraps
+import os
+import time
+
+from flask import Response, request
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+REGISTRY = CollectorRegistry()
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CALLBACK_SECONDS = Histogram(
+    'dashboard_callback_seconds', 'Wall time of every callback', ['callback'],
+    buckets=LATENCY_BUCKETS, registry=REGISTRY
+)
+CALLBACK_ERRORS = Counter(
+    'dashboard_callback_errors', 'Callbacks that raised', ['callback'], registry=REGISTRY
+)
+FILTERED_ROWS = Histogram(
+    'dashboard_filtered_rows', 'Rows left after applying the filters of a callback', ['callback'],
+    buckets=(0, 10, 100, 1e3, 1e4, 1e5, 1e6, 1e7), registry=REGISTRY
+)
+RESPONSE_BYTES = Histogram(
+    'dashboard_response_bytes', 'Size of the serialized callback responses', ['output'],
+    buckets=(1e3, 5e3, 1e4, 5e4, 1e5, 5e5, 1e6, 5e6), registry=REGISTRY
+)
+FIGURE_REQUESTS = Counter(
+    'dashboard_figure_requests', 'Calls of the figure callbacks', ['callback'], registry=REGISTRY
+)
+FIGURE_COALESCED = Counter(
+    'dashboard_figure_coalesced', 'Figure calls that waited on an identical one in flight instead of computing it',
+    ['callback'], registry=REGISTRY
+)
+BACKGROUND_JOBS = Counter(
+    'dashboard_background_jobs', 'Background callback jobs started, and those that waited for a slot of their session',
+    ['event'], registry=REGISTRY
+)
+DATA_LOAD_SECONDS = Histogram(
+    'dashboard_data_load_seconds', 'Time to load the data of a team', ['origin'],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600), registry=REGISTRY
+)
+
+
+def timed(func):
+    """
+    Records the wall time (and errors) of a callback, place it below @callback
+    """
+    latency = CALLBACK_SECONDS.labels(func.__name__)
+    errors = CALLBACK_ERRORS.labels(func.__name__)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            latency.observe(time.perf_counter() - start)
+
+    return wrapper
+
+
+def observe_rows(callback: str, rows: int):
+    FILTERED_ROWS.labels(callback).observe(rows)
+
+
+def register_metrics_route(server, route: str = '/metrics'):
+    """
+    Serves the metrics on route and records the size of every callback response
+    """
+    @server.after_request
+    def record_response_size(response):
+        if request.path.endswith('/_dash-update-component') and response.content_length is not None:
+            body = request.get_json(silent=True) or {}
+            RESPONSE_BYTES.labels(body.get('output', 'unknown')).observe(response.content_length)
+        return response
+
+    def metrics():
+        if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+    server.add_url_rule(route, 'metrics', metrics)
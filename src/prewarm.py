@@ -0,0 +1,57 @@
+"""
+Background prewarming of the figure caches.
+
+Figures are computed once on a pool of threads in a daemon thread, so the
+server accepts requests from the start and the first user to pick a player
+gets a cache hit instead of paying the cold cost of every callback.
+
+Set DASHBOARD_PREWARM_WORKERS to the number of threads to enable it.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PREWARM_WORKERS = int(os.environ.get('DASHBOARD_PREWARM_WORKERS', 0))
+# Progress is logged every this many tasks
+PREWARM_LOG_EVERY = 50
+
+
+def run_prewarm(tasks, workers: int = PREWARM_WORKERS):
+    """
+    Calls every (func, args) of tasks on a pool of workers threads. Failures
+    are logged and skipped, a task that fails on a request will fail there too
+    """
+    tasks = list(tasks)
+    start = time.perf_counter()
+    failed = 0
+    logger.info('Prewarming %d figures on %d workers', len(tasks), workers)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prewarm') as executor:
+        futures = {executor.submit(func, *args): (func, args) for func, args in tasks}
+        for done, future in enumerate(as_completed(futures), 1):
+            if future.exception() is not None:
+                failed += 1
+                func, args = futures[future]
+                logger.warning('Prewarming %s%s failed: %s', func.__name__, args, future.exception())
+            if done % PREWARM_LOG_EVERY == 0 and done < len(tasks):
+                logger.info('Prewarmed %d/%d figures in %.1fs', done, len(tasks), time.perf_counter() - start)
+
+    logger.info(
+        'Prewarmed %d figures (%d failed) in %.1fs', len(tasks) - failed, failed, time.perf_counter() - start
+    )
+
+
+def start_prewarm(tasks, workers: int = PREWARM_WORKERS):
+    """
+    Runs run_prewarm in a daemon thread and returns it, or None when workers is 0
+    """
+    if workers <= 0:
+        return None
+
+    thread = threading.Thread(target=run_prewarm, args=(tasks, workers), name='prewarm', daemon=True)
+    thread.start()
+    return thread
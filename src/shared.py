@@ -0,0 +1,201 @@
+"""
+TeamData shared by every process through memory-mapped files.
+
+The columns of the frames (categorical codes and dictionaries included),
+the indexes and the cumulative xG of a partition are written once as .npy
+files and every gunicorn worker maps them read-only, so N workers share one
+copy of the data in the page cache instead of building one each. Put
+SHARED_DIR on a tmpfs (e.g. /dev/shm) to keep the files off the disk.
+
+Files go under <SHARED_DIR>/v<SCHEMA_VERSION>/<competition>/<season>/<team>/
+<fingerprint>/, where the fingerprint changes with the cached frames
+(rebuilds and ingested matches) and the pitch dimensions. Works with and
+without gunicorn --preload: preloaded workers inherit the mapping, the
+others map the files the first one wrote.
+"""
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from src.cache import FRAME_NAMES, cache_path, match_paths
+from src.index import CumulativeXG, EventIndex
+
+SHARED_DIR = os.environ.get('DASHBOARD_SHARED_DIR')
+# Bump whenever the layout of the files changes
+SHARED_FORMAT = 1
+INDEX_ARRAYS = ['_positions', '_keys', '_player_positions', '_player_keys', '_offsets']
+CUMULATIVE_ARRAYS = [
+    '_team_matchdays', '_team_cum_xg', '_player_matchdays', '_player_cum_xg', '_player_cum_goals', '_offsets'
+]
+
+
+def fingerprint(partition, cache_dir: str, pitch_dimensions: tuple = None):
+    """
+    Identifies the cached frames of partition as they are now, None if
+    they aren't cached yet
+    """
+    path = cache_path(partition.team, partition.competition, partition.season, cache_dir)
+    files = [
+        os.path.join(directory, f'{name}.parquet')
+        for directory in [path] + match_paths(path) for name in FRAME_NAMES
+    ]
+    if not all(os.path.exists(file) for file in files[:len(FRAME_NAMES)]):
+        return None
+
+    digest = hashlib.sha1(repr((SHARED_FORMAT, pitch_dimensions)).encode())
+    for file in files:
+        if os.path.exists(file):
+            stat = os.stat(file)
+            digest.update(f'{os.path.relpath(file, path)}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    return digest.hexdigest()[:16]
+
+
+def shared_path(partition, key: str, shared_dir: str = SHARED_DIR):
+    return os.path.join(cache_path(partition.team, partition.competition, partition.season, shared_dir), key)
+
+
+@contextmanager
+def shared_lock(partition, shared_dir: str = SHARED_DIR):
+    """
+    Held by one process at a time per partition, so only one builds (or
+    extends) it while the rest wait to map what it wrote
+    """
+    directory = cache_path(partition.team, partition.competition, partition.season, shared_dir)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, '.lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def write_shared(data, path: str):
+    """
+    Writes data to path, to a temporary directory first so other processes
+    never map a partial copy. If another process wrote it first, keeps theirs
+    """
+    tmp = f'{path}.{os.getpid()}.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    meta = {
+        'frames': {name: _write_frame(frame, os.path.join(tmp, name)) for name, frame in data.frames.items()},
+        'indexes': {
+            name: _write_arrays(index, INDEX_ARRAYS, os.path.join(tmp, 'indexes', name))
+            for name, index in data.indexes.items()
+        },
+        'cumulative_xg': _write_arrays(data.cumulative_xg, CUMULATIVE_ARRAYS, os.path.join(tmp, 'cumulative_xg')),
+        'ordered_matchdays': [int(match_id) for match_id in data.ordered_matchdays],
+        'player_options': data.player_options,
+    }
+    with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # Already written by another process
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+
+    # Older versions of the partition, processes mapping them keep their files
+    for name in os.listdir(os.path.dirname(path)):
+        if name != os.path.basename(path) and not name.endswith('.tmp') and name != '.lock':
+            shutil.rmtree(os.path.join(os.path.dirname(path), name), ignore_errors=True)
+
+
+def read_shared(path: str):
+    """
+    Returns the TeamData written to path with every array memory-mapped
+    read-only, None if it was not written
+    """
+    # Imported here, src.store imports this module
+    from src.store import TeamData
+
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        return None
+    with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+
+    data = object.__new__(TeamData)
+    data.frames = {name: _read_frame(os.path.join(path, name), columns) for name, columns in meta['frames'].items()}
+    data.events, data.shots, data.assists = [data.frames[name] for name in FRAME_NAMES]
+    data.ordered_matchdays = meta['ordered_matchdays']
+    data.player_options = meta['player_options']
+    data.indexes = {
+        name: _read_arrays(EventIndex, attributes, os.path.join(path, 'indexes', name))
+        for name, attributes in meta['indexes'].items()
+    }
+    data.cumulative_xg = _read_arrays(CumulativeXG, meta['cumulative_xg'], os.path.join(path, 'cumulative_xg'))
+    data._set_nbytes()
+    return data
+
+
+def _write_frame(frame: pd.DataFrame, path: str):
+    """
+    Writes every column of frame (and its index unless it is a RangeIndex)
+    to path, returns the column names and kinds
+    """
+    os.makedirs(path)
+    columns = []
+    for i, (column, values) in enumerate(frame.items()):
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(path, f'{i}.npy'), values.cat.codes.to_numpy())
+            np.save(os.path.join(path, f'{i}.categories.npy'), values.cat.categories.to_numpy(dtype=str))
+            columns.append([column, 'category'])
+        else:
+            np.save(os.path.join(path, f'{i}.npy'), _plain(values.to_numpy()))
+            columns.append([column, str(values.dtype) if values.dtype != object else 'str'])
+
+    if not isinstance(frame.index, pd.RangeIndex):
+        np.save(os.path.join(path, 'index.npy'), _plain(frame.index.to_numpy()))
+    return {'columns': columns, 'index': frame.index.name, 'rows': len(frame)}
+
+
+def _read_frame(path: str, meta: dict):
+    columns = {}
+    for i, (column, kind) in enumerate(meta['columns']):
+        values = np.load(os.path.join(path, f'{i}.npy'), mmap_mode='r')
+        if kind == 'category':
+            categories = np.load(os.path.join(path, f'{i}.categories.npy'), mmap_mode='r')
+            values = pd.Categorical.from_codes(values, dtype=pd.CategoricalDtype(pd.Index(categories, dtype=object)))
+        elif kind == 'str':
+            values = np.asarray(values, dtype=object)
+        columns[column] = values
+
+    if os.path.exists(os.path.join(path, 'index.npy')):
+        index = np.load(os.path.join(path, 'index.npy'))
+        index = pd.Index(index.astype(object) if index.dtype.kind == 'U' else index, name=meta['index'])
+    else:
+        index = pd.RangeIndex(meta['rows'], name=meta['index'])
+    return pd.DataFrame(columns, index=index, copy=False)
+
+
+def _write_arrays(obj, names, path: str):
+    """
+    Writes the array attributes names of obj to path, returns the rest
+    """
+    os.makedirs(path)
+    for name in names:
+        np.save(os.path.join(path, f'{name}.npy'), getattr(obj, name))
+    return {'n_matchdays': obj.n_matchdays, 'players': obj.players.tolist(), 'arrays': names}
+
+
+def _read_arrays(cls, meta: dict, path: str):
+    obj = object.__new__(cls)
+    obj.n_matchdays = meta['n_matchdays']
+    obj.players = pd.Index(meta['players'], dtype=object)
+    for name in meta['arrays']:
+        setattr(obj, name, np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r'))
+    return obj
+
+
+def _plain(values):
+    # Object columns (ids, names) are stored as fixed width strings, np.save
+    # would pickle them and pickles can't be mapped
+    return values.astype(str) if values.dtype == object else values
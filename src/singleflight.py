@@ -0,0 +1,53 @@
+"""
+Single-flight calls: concurrent calls with the same key run once.
+
+The first caller of a key runs it, the ones arriving while it runs wait for
+it and share its result (or exception) instead of computing it again. Once
+it returns the key is forgotten, caching results is up to the caller.
+"""
+from concurrent.futures import Future
+import os
+import threading
+
+
+class SingleFlight():
+
+    def __init__(self):
+        self._reset()
+        # A forked process (background callback jobs, gunicorn --preload)
+        # would wait forever on the calls its parent's threads had in flight
+        os.register_at_fork(after_in_child=self._reset)
+
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+
+    def do(self, key, func, *args):
+        """
+        Returns func(*args), computed once for all the concurrent calls with
+        key, and whether this call waited on another one instead
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = Future()
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            return call.result(), True
+
+        try:
+            result = func(*args)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return result, False
@@ -0,0 +1,165 @@
+"""
+Data sources prepare_team_data can read StatsBomb data from.
+
+- StatsBombAPISource goes through statsbombpy (needs network access)
+- LocalOpenDataSource reads a local copy of the open-data repository
+  (https://github.com/statsbomb/open-data), laid out as:
+
+    <root>/competitions.json
+    <root>/matches/<competition_id>/<season_id>.json
+    <root>/events/<match_id>.json
+
+Set STATSBOMB_DATA_DIR to the local copy to use it by default.
+"""
+import json
+import os
+
+import pandas as pd
+
+DATA_DIR = os.environ.get('STATSBOMB_DATA_DIR')
+
+# Event columns used by prepare_team_data and the path to them in the event
+# JSON, named the way statsbombpy flattens them
+EVENT_FIELDS = {
+    'id': ('id',),
+    'type': ('type', 'name'),
+    'team': ('team', 'name'),
+    'player': ('player', 'name'),
+    'location': ('location',),
+    'timestamp': ('timestamp',),
+    'minute': ('minute',),
+    'second': ('second',),
+    'shot_type': ('shot', 'type', 'name'),
+    'shot_outcome': ('shot', 'outcome', 'name'),
+    'shot_statsbomb_xg': ('shot', 'statsbomb_xg'),
+    'pass_shot_assist': ('pass', 'shot_assist'),
+    'pass_recipient': ('pass', 'recipient', 'name'),
+}
+# Characters read at a time while streaming an events file
+READ_CHUNK_SIZE = 1 << 16
+
+
+class DataSource():
+    """
+    Interface of the data sources, every method returns a dataframe shaped
+    like the statsbombpy one
+    """
+
+    def competitions(self):
+        raise NotImplementedError
+
+    def matches(self, competition_id: int, season_id: int):
+        raise NotImplementedError
+
+    def events(self, match_id: int):
+        raise NotImplementedError
+
+
+class StatsBombAPISource(DataSource):
+
+    def competitions(self):
+        from statsbombpy import sb
+        return sb.competitions()
+
+    def matches(self, competition_id: int, season_id: int):
+        from statsbombpy import sb
+        return sb.matches(competition_id=competition_id, season_id=season_id)
+
+    def events(self, match_id: int):
+        from statsbombpy import sb
+        return sb.events(match_id=match_id)
+
+
+class LocalOpenDataSource(DataSource):
+
+    def __init__(self, root: str, fields: dict = EVENT_FIELDS):
+        self.root = root
+        self.fields = fields
+
+    def competitions(self):
+        with open(os.path.join(self.root, 'competitions.json'), encoding='utf-8') as f:
+            return pd.DataFrame(json.load(f))
+
+    def matches(self, competition_id: int, season_id: int):
+        path = os.path.join(self.root, 'matches', str(competition_id), f'{season_id}.json')
+        with open(path, encoding='utf-8') as f:
+            matches = json.load(f)
+
+        return pd.DataFrame({
+            'match_id': [match['match_id'] for match in matches],
+            'match_date': [match['match_date'] for match in matches],
+            'home_team': [match['home_team']['home_team_name'] for match in matches],
+            'away_team': [match['away_team']['away_team_name'] for match in matches],
+        })
+
+    def events(self, match_id: int):
+        """
+        Reads the events of a match one at a time, keeping only the columns
+        in fields, so the whole JSON document is never held in memory
+        """
+        columns = {column: [] for column in self.fields}
+
+        with open(os.path.join(self.root, 'events', f'{match_id}.json'), encoding='utf-8') as f:
+            for event in iter_json_array(f):
+                for column, path in self.fields.items():
+                    columns[column].append(_get_path(event, path))
+
+        events = pd.DataFrame(columns)
+        events['match_id'] = match_id
+        return events
+
+
+def default_source(data_dir: str = DATA_DIR):
+    """
+    The local open-data copy in data_dir if given, the statsbomb API otherwise
+    """
+    return LocalOpenDataSource(data_dir) if data_dir else StatsBombAPISource()
+
+
+def _get_path(event: dict, path: tuple):
+    for key in path:
+        if not isinstance(event, dict) or key not in event:
+            return None
+        event = event[key]
+    return event
+
+
+def iter_json_array(f, chunk_size: int = READ_CHUNK_SIZE):
+    """
+    Yields the objects of the top-level JSON array in file f one by one,
+    reading it in chunks of chunk_size characters
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+
+    while True:
+        # Skip whitespace and separators until the next element
+        while position < len(buffer) and buffer[position] in ' \t\r\n,[':
+            if buffer[position] == '[':
+                if started:
+                    break
+                started = True
+            position += 1
+
+        if position < len(buffer) and buffer[position] == ']':
+            return
+
+        try:
+            element, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # Element cut at the end of the buffer, read more
+            if eof:
+                if buffer[position:].strip():
+                    raise
+                return
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+
+        yield element
+        position = end
@@ -0,0 +1,312 @@
+"""
+Team data partitioned by competition, season and team.
+
+Partitions are loaded on first use (see load_team_data) and kept in an LRU
+that evicts the least recently used ones once their memory goes over the
+budget, so memory stays bounded however many partitions are configured.
+
+New matches are ingested one at a time (see DataStore.ingest). TeamData is
+never modified, ingesting builds a new one and swaps it in, so a request
+sees the data of a partition either before or after the match.
+
+With DASHBOARD_SHARED_DIR set, loaded partitions are memory-mapped from
+files every process shares (see src.shared) instead of built per process,
+and matches ingested by one process are mapped by the others too.
+"""
+from collections import OrderedDict, namedtuple
+from contextlib import nullcontext
+from functools import cached_property
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from src.cache import CACHE_DIR, ingest_match_data, load_team_data
+from src.functions import concat_frames
+from src.index import CumulativeXG, EventIndex
+from src.shared import SHARED_DIR, fingerprint, read_shared, shared_lock, shared_path, write_shared
+
+logger = logging.getLogger(__name__)
+
+Partition = namedtuple('Partition', ['competition', 'season', 'team'])
+
+DEFAULT_PARTITIONS = [Partition('La Liga', '2015/2016', 'Barcelona')]
+MEMORY_BUDGET_MB = int(os.environ.get('DASHBOARD_MEMORY_BUDGET_MB', 1024))
+# How often a process sharing data checks whether another one changed it
+SHARED_CHECK_SECONDS = float(os.environ.get('DASHBOARD_SHARED_CHECK_SECONDS', 1))
+
+
+def parse_partitions(value: str):
+    """
+    Parses 'competition|season|team' entries separated by ';'
+    (e.g. 'La Liga|2015/2016|Barcelona;La Liga|2015/2016|Real Madrid')
+    """
+    return [Partition(*entry.split('|')) for entry in value.split(';') if entry.strip()]
+
+
+class TeamData():
+    """
+    Frames of one partition plus everything derived from them at load time
+    """
+
+    def __init__(self, events, shots, assists):
+        self.events = events
+        self.shots = shots
+        self.assists = assists
+        self.frames = {'events': events, 'shots': shots, 'assists': assists}
+
+        self.ordered_matchdays = events.sort_values('match_date')['match_id'].unique().tolist()
+        self.player_options = ['All players'] + sorted(shots['player'].unique().tolist())
+        self.indexes = {name: EventIndex(frame, self.ordered_matchdays) for name, frame in self.frames.items()}
+        self.cumulative_xg = CumulativeXG(shots, self.ordered_matchdays)
+
+        self._set_nbytes()
+
+
+    @cached_property
+    def version(self):
+        """
+        Identifies the matches of the data, equal whichever process built or
+        mapped it
+        """
+        return hashlib.sha1(repr([int(match_id) for match_id in self.ordered_matchdays]).encode()).hexdigest()[:16]
+
+
+    def _set_nbytes(self):
+        self.nbytes = sum(frame.memory_usage(deep=True).sum() for frame in self.frames.values()) + sum(
+            index.nbytes for index in self.indexes.values()
+        ) + self.cumulative_xg.nbytes
+
+
+    def extend(self, events, shots, assists):
+        """
+        Returns a new TeamData with the frames of one more match. When it was
+        played after every match of the partition only its rows are indexed
+        and summed, otherwise everything is rebuilt
+        """
+        if not len(events):
+            return self
+
+        new_frames = {'events': events, 'shots': shots, 'assists': assists}
+        frames = {name: concat_frames([self.frames[name], new_frames[name]]) for name in self.frames}
+
+        if _first_date(events) <= _last_date(self.events):
+            return TeamData(frames['events'], frames['shots'], frames['assists'])
+
+        data = object.__new__(TeamData)
+        data.events, data.shots, data.assists = frames['events'], frames['shots'], frames['assists']
+        data.frames = frames
+        data.ordered_matchdays = self.ordered_matchdays + events['match_id'].unique().tolist()
+        data.player_options = ['All players'] + sorted(
+            set(self.player_options[1:]) | set(shots['player'].dropna().unique().tolist())
+        )
+        data.indexes = {
+            name: index.extend(new_frames[name], len(self.frames[name])) for name, index in self.indexes.items()
+        }
+        data.cumulative_xg = self.cumulative_xg.extend(shots)
+        data._set_nbytes()
+        return data
+
+
+def _first_date(events):
+    # Categories of compact frames are sorted, codes follow the dates
+    return events['match_date'].cat.categories[events['match_date'].cat.codes.min()]
+
+
+def _last_date(events):
+    return events['match_date'].cat.categories[events['match_date'].cat.codes.max()]
+
+
+class DataStore():
+
+    def __init__(
+            self, partitions, memory_budget_mb: float = MEMORY_BUDGET_MB, pitch_dimensions: tuple = None,
+            shared_dir: str = SHARED_DIR
+        ):
+        self.partitions = list(partitions)
+        self.memory_budget = memory_budget_mb * 1024**2
+        self.pitch_dimensions = pitch_dimensions
+        self.shared_dir = shared_dir
+        # Called with the partition and its TeamData whenever the data leaves
+        # the store (evicted or replaced), so caches keyed by it can drop it
+        self.release_hooks = []
+        self._loaded = OrderedDict()
+        # Fingerprint of the shared files each loaded partition was mapped
+        # from and when it was last checked against the cache
+        self._shared_keys = {}
+        self._reset_locks()
+        # Processes forked while another thread held a lock (background
+        # callback jobs) would wait on it forever
+        os.register_at_fork(after_in_child=self._reset_locks)
+
+
+    def _reset_locks(self):
+        self._lock = threading.Lock()
+        self._load_locks = {partition: threading.Lock() for partition in self.partitions}
+
+
+    @property
+    def nbytes(self):
+        return sum(data.nbytes for data in list(self._loaded.values()))
+
+
+    def teams(self):
+        return sorted({partition.team for partition in self.partitions})
+
+
+    def seasons(self, team: str):
+        return [partition for partition in self.partitions if partition.team == team]
+
+
+    def get(self, partition: Partition):
+        """
+        Returns the TeamData of partition, loading it on first use
+        """
+        if partition not in self._load_locks:
+            raise KeyError(f'Unknown partition {partition}')
+
+        with self._lock:
+            data = self._loaded.get(partition)
+            if data is not None:
+                self._loaded.move_to_end(partition)
+        if data is not None and not self._stale(partition):
+            return data
+
+        # Only one thread loads a partition, the rest wait for it
+        with self._load_locks[partition]:
+            with self._lock:
+                data = self._loaded.get(partition)
+            if data is not None and not self._stale(partition):
+                return data
+
+            start = time.perf_counter()
+            with self._shared_lock(partition):
+                data = self._map(partition)
+                if data is None:
+                    data = self._share(partition, TeamData(*load_team_data(
+                        partition.team, partition.competition, partition.season, pitch_dimensions=self.pitch_dimensions
+                    )))
+
+            with self._lock:
+                # Replaced when another process changed it
+                replaced = self._loaded.get(partition)
+                self._loaded[partition] = data
+                self._loaded.move_to_end(partition)
+                if replaced is not None:
+                    self._release(partition, replaced)
+                self._evict()
+                logger.info(
+                    'Partition %s ready in %.2fs (%.1f MB, %d loaded, %.1f MB total)',
+                    '/'.join(partition), time.perf_counter() - start, data.nbytes / 1024**2,
+                    len(self._loaded), self.nbytes / 1024**2
+                )
+
+            return data
+
+
+    def ingest(self, partition: Partition, match_id: int, source=None):
+        """
+        Adds match_id to the cache of partition and, if loaded, to its data.
+        Returns the TeamData with the match (None when partition isn't loaded,
+        it is read along the next time it loads). Matches of the cached
+        season are left as they are. With sharing on, other processes that
+        loaded the partition pick the match up within SHARED_CHECK_SECONDS
+        """
+        if partition not in self._load_locks:
+            raise KeyError(f'Unknown partition {partition}')
+
+        # Serialized with the loads (and other ingests) of the partition. Other
+        # processes see the match once it is written to the cache, so they
+        # wait for it to be shared instead of loading the partition themselves
+        with self._load_locks[partition], self._shared_lock(partition):
+            frames = ingest_match_data(
+                match_id, partition.team, partition.competition, partition.season,
+                pitch_dimensions=self.pitch_dimensions, source=source
+            )
+            with self._lock:
+                data = self._loaded.get(partition)
+            if data is None or frames is None:
+                return data
+            if match_id in data.ordered_matchdays:
+                # Loaded after the match was written to the cache
+                return data
+
+            start = time.perf_counter()
+            # Another process may have shared the partition with the match already
+            replaced, data = data, self._map(partition) or self._share(partition, data.extend(*frames))
+
+            with self._lock:
+                if partition in self._loaded:
+                    self._loaded[partition] = data
+                    self._loaded.move_to_end(partition)
+                    self._release(partition, replaced)
+                    self._evict()
+            logger.info(
+                'Match %s added to %s in %.3fs (%d matchdays, %.1f MB)', match_id, '/'.join(partition),
+                time.perf_counter() - start, len(data.ordered_matchdays), data.nbytes / 1024**2
+            )
+            return data
+
+
+    def _shared_lock(self, partition: Partition):
+        return shared_lock(partition, self.shared_dir) if self.shared_dir else nullcontext()
+
+
+    def _map(self, partition: Partition):
+        """
+        Returns the shared TeamData of partition matching its cache, None if
+        sharing is off or no process shared it yet
+        """
+        if not self.shared_dir:
+            return None
+        key = fingerprint(partition, CACHE_DIR, self.pitch_dimensions)
+        data = read_shared(shared_path(partition, key, self.shared_dir)) if key is not None else None
+        if data is not None:
+            self._shared_keys[partition] = (key, time.monotonic())
+        return data
+
+
+    def _share(self, partition: Partition, data: TeamData):
+        """
+        Writes data for the other processes and returns it mapped from there,
+        data itself when sharing is off
+        """
+        if not self.shared_dir:
+            return data
+        key = fingerprint(partition, CACHE_DIR, self.pitch_dimensions)
+        path = shared_path(partition, key, self.shared_dir)
+        write_shared(data, path)
+        self._shared_keys[partition] = (key, time.monotonic())
+        return read_shared(path) or data
+
+
+    def _stale(self, partition: Partition):
+        """
+        Whether another process changed the cache of loaded partition (ingested
+        a match) since it was mapped here. Checked at most every
+        SHARED_CHECK_SECONDS, never when sharing is off
+        """
+        if not self.shared_dir:
+            return False
+        key, checked = self._shared_keys.get(partition, (None, 0))
+        now = time.monotonic()
+        if now - checked < SHARED_CHECK_SECONDS:
+            return False
+        if fingerprint(partition, CACHE_DIR, self.pitch_dimensions) != key:
+            return True
+        self._shared_keys[partition] = (key, now)
+        return False
+
+
+    def _evict(self):
+        # Never evict the partition just used, even if it alone is over the budget
+        while len(self._loaded) > 1 and self.nbytes > self.memory_budget:
+            partition, data = self._loaded.popitem(last=False)
+            self._release(partition, data)
+            logger.info('Evicted partition %s', '/'.join(partition))
+
+
+    def _release(self, partition: Partition, data: TeamData):
+        for hook in self.release_hooks:
+            hook(partition, data)
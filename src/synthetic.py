@@ -0,0 +1,84 @@
+"""
+Synthetic team data shaped like the frames prepare_team_data returns, for
+benchmarks and offline checks. Seasons are generated one after another, so
+n_seasons scales the frames (and the matchday slider) linearly.
+"""
+import numpy as np
+import pandas as pd
+
+from src.functions import compact_frame, player_name_mapper
+
+PLAYERS = sorted(set(player_name_mapper.values()))
+OPPONENT_PLAYERS = [f'Opponent {i}' for i in range(1, 19)]
+MATCHES_PER_SEASON = 38
+# Roughly the averages of a real La Liga match
+EVENTS_PER_MATCH = 3400
+SHOTS_PER_MATCH = 15
+ASSISTS_PER_MATCH = 20
+
+
+def synthetic_team_data(
+        n_seasons: int = 1,
+        matches_per_season: int = MATCHES_PER_SEASON,
+        events_per_match: int = EVENTS_PER_MATCH,
+        shots_per_match: int = SHOTS_PER_MATCH,
+        assists_per_match: int = ASSISTS_PER_MATCH,
+        team: str = 'Barcelona',
+        seed: int = 0,
+        compact: bool = True
+    ):
+    """
+    Returns three dataframes regarding all_events, shots and assists with the
+    columns the dashboard reads (no location list column), in the compact
+    dtypes unless compact is False (object strings and int64 integers)
+    """
+    rng = np.random.default_rng(seed)
+    n_matches = n_seasons * matches_per_season
+
+    match_ids = np.arange(1, n_matches + 1)
+    match_dates = pd.Timestamp('2015-08-23') + pd.to_timedelta(np.arange(n_matches) * 7, unit='D')
+    match_minutes = rng.uniform(92, 98, n_matches)
+
+    def frame(rows_per_match: int, players):
+        n = n_matches * rows_per_match
+        match = np.repeat(np.arange(n_matches), rows_per_match)
+        float_time = np.sort(rng.uniform(0, 1, (n_matches, rows_per_match)), axis=1).ravel() * match_minutes[match]
+        minute = float_time.astype(int)
+        second = ((float_time - minute) * 60).astype(int)
+
+        return pd.DataFrame({
+            'match_id': match_ids[match],
+            'match_date': match_dates[match].strftime('%Y-%m-%d'),
+            'player': np.asarray(players, dtype=object)[rng.integers(0, len(players), n)],
+            'x': rng.uniform(0, 120, n).round(1),
+            'y': rng.uniform(0, 80, n).round(1),
+            'minute': minute,
+            'minutes': match_minutes[match],
+            'float_time': minute + second / 60,
+        })
+
+    # Some events (half start/end, tactical shifts...) have no player
+    events = frame(events_per_match, PLAYERS + OPPONENT_PLAYERS + [None])
+    events = events[['match_id', 'match_date', 'player', 'x', 'y', 'minute', 'minutes', 'float_time']]
+
+    shots = frame(shots_per_match, PLAYERS)
+    # Shots are taken in the attacking half
+    shots['x'] = (60 + shots['x'] / 2).round(1)
+    shots['shot_statsbomb_xg'] = rng.beta(1, 9, len(shots))
+    shots['goal'] = rng.uniform(0, 1, len(shots)) < shots['shot_statsbomb_xg']
+    shots['shot_outcome'] = np.where(shots['goal'], 'Goal', 'Saved')
+    shots['shot_type'] = 'Open Play'
+    shots.index = pd.Index([f'shot-{i}' for i in range(len(shots))], name='id')
+    shots = shots[[
+        'match_id', 'x', 'y', 'float_time', 'player', 'shot_outcome',
+        'shot_type', 'minutes', 'goal', 'shot_statsbomb_xg'
+    ]]
+
+    assists = frame(assists_per_match, PLAYERS)
+    assists['team'] = team
+    assists['pass_recipient'] = np.asarray(PLAYERS, dtype=object)[rng.integers(0, len(PLAYERS), len(assists))]
+    assists = assists[['match_id', 'x', 'y', 'float_time', 'player', 'team', 'pass_recipient', 'minutes']]
+
+    if compact:
+        return compact_frame(events), compact_frame(shots), compact_frame(assists)
+    return events, shots, assists
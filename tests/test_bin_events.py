@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from src.benchmark import bin_events_loop
+from src.classes import FootballPitch
+from src.functions import bin_events, get_player_events
+from src.synthetic import synthetic_team_data
+
+
+@pytest.fixture(scope='module')
+def season_events():
+    """
+    "All players" events of a full synthetic season on a default pitch
+    """
+    events, _, _ = synthetic_team_data(1)
+    return get_player_events('All players', events, FootballPitch())
+
+
+@pytest.mark.parametrize('cell_size', [3, 5])
+def test_bin_events_matches_loop(season_events, cell_size):
+    pitch = FootballPitch()
+    counts = bin_events(season_events['x'], season_events['y'], pitch.pitch_length, pitch.pitch_width, cell_size)
+    expected = bin_events_loop(season_events, pitch.pitch_length, pitch.pitch_width, cell_size)
+
+    assert counts.shape == expected.shape
+    np.testing.assert_array_equal(counts, expected)
+    assert counts.sum() > 0
+
+
+def test_bin_events_empty():
+    pitch = FootballPitch()
+    counts = bin_events([], [], pitch.pitch_length, pitch.pitch_width, 3)
+    assert counts.shape == (23, 35)
+    assert not counts.any()
@@ -0,0 +1,50 @@
+import importlib
+
+import plotly.io as pio
+import pytest
+
+from src.benchmark import CALLBACKS, GAME_RANGE_ONLY, filter_grid
+from src.synthetic import synthetic_team_data
+
+TEAM = 'Synthetic FC'
+COMPETITION = 'Synthetic League'
+SEASONS = {'compact': True, 'uncompacted': False}
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    """
+    The dashboard on two copies of the same synthetic season, one written
+    with the compact frames and one with the frames before compact_frame
+    """
+    cache_dir = str(tmp_path_factory.mktemp('data_cache'))
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        # The app reads its partitions and cache location at import
+        monkeypatch.setenv('DASHBOARD_CACHE_DIR', cache_dir)
+        monkeypatch.setenv('DASHBOARD_PARTITIONS', ';'.join(f'{COMPETITION}|{season}|{TEAM}' for season in SEASONS))
+        # Imported here, src.cache reads DASHBOARD_CACHE_DIR at import
+        from src.cache import cache_path, write_team_data
+
+        for season, compact in SEASONS.items():
+            frames = synthetic_team_data(1, matches_per_season=8, events_per_match=500, team=TEAM, compact=compact)
+            write_team_data(frames, cache_path(TEAM, COMPETITION, season, cache_dir))
+        yield importlib.import_module('app')
+
+
+def test_compact_frames_render_the_same_figures(app):
+    _, compact = app.get_partition(TEAM, f'{COMPETITION}|compact')
+    _, uncompacted = app.get_partition(TEAM, f'{COMPETITION}|uncompacted')
+    assert compact.nbytes < uncompacted.nbytes
+
+    players = ['All players', compact.player_options[1], compact.player_options[-1]]
+    for player, game_range, minute_range in filter_grid(len(compact.ordered_matchdays), players):
+        for name in CALLBACKS:
+            if name in GAME_RANGE_ONLY:
+                args = [list(game_range)]
+            else:
+                args = [player, list(game_range), list(minute_range)]
+            figures = [
+                pio.to_json(getattr(app, name)(*args, TEAM, f'{COMPETITION}|{season}'), validate=False)
+                for season in SEASONS
+            ]
+            assert figures[0] == figures[1], (name, player, game_range, minute_range)
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from src.functions import minute_string_to_float, normalize_events
+
+TEAM = 'Barcelona'
+
+
+def raw_match_events(match_id: int, n_events: int = 200, seed: int = 0, half_ends: bool = True):
+    """
+    Events of one match shaped like statsbombpy returns them, with the
+    columns normalize_events reads
+    """
+    rng = np.random.default_rng(seed)
+    minute = rng.integers(0, 125, n_events)
+    second = rng.integers(0, 60, n_events)
+    x, y = rng.uniform(0, 120, n_events).round(1), rng.uniform(0, 80, n_events).round(1)
+    # Some events have no location and some locations are whole numbers
+    locations = [
+        np.nan if i % 7 == 0 else [int(x[i]), int(y[i])] if i % 11 == 0 else [float(x[i]), float(y[i])]
+        for i in range(n_events)
+    ]
+    events = pd.DataFrame({
+        'match_id': match_id,
+        'type': rng.choice(['Pass', 'Carry', 'Shot'], n_events),
+        'team': rng.choice([TEAM, 'Opponent'], n_events),
+        'timestamp': [
+            f'00:{m % 60:02d}:{s:02d}.{ms:03d}' for m, s, ms in zip(minute, second, rng.integers(0, 1000, n_events))
+        ],
+        'location': locations,
+        'minute': minute,
+        'second': second,
+    })
+    if half_ends:
+        # Both teams get a Half End per half, only the team's ones count
+        events.loc[:3, 'type'] = 'Half End'
+        events.loc[:3, 'team'] = [TEAM, 'Opponent', TEAM, 'Opponent']
+        events.loc[:3, 'timestamp'] = ['00:47:02.512', '00:47:02.512', '00:48:30.007', '00:48:30.007']
+    return events
+
+
+def apply_normalize_events(match_events, team: str):
+    """
+    The row-wise implementation normalize_events replaced (per match, then
+    with apply over the concatenated events)
+    """
+    for events in match_events:
+        events['minutes'] = events[
+            (events['type'] == 'Half End')
+            & (events['team'] == team)
+        ]['timestamp'].apply(lambda x: minute_string_to_float(x, True)).sum()
+
+    all_events = pd.concat(match_events)
+    all_events['x'] = all_events['location'].apply(lambda x: x[0] if not isinstance(x, float) else x)
+    all_events['y'] = all_events['location'].apply(lambda x: x[1] if not isinstance(x, float) else x)
+    all_events['time'] = all_events.apply(lambda x: f"{str(x['minute']).zfill(2)}:{str(x['second']).zfill(2)}", axis=1)
+    all_events['float_time'] = all_events.minute + (all_events.second/60)
+    all_events['y'] = 80 - all_events['y']
+    return all_events
+
+
+def test_normalize_events_matches_apply():
+    matches = [raw_match_events(match_id, seed=match_id) for match_id in range(1, 6)]
+    expected = apply_normalize_events([events.copy() for events in matches], TEAM)
+    result = normalize_events(pd.concat(matches), TEAM)
+    assert_frame_equal(result, expected, check_exact=True)
+
+
+def test_normalize_events_match_without_half_end():
+    matches = [raw_match_events(1), raw_match_events(2, seed=1, half_ends=False)]
+    expected = apply_normalize_events([events.copy() for events in matches], TEAM)
+    result = normalize_events(pd.concat(matches), TEAM)
+    assert_frame_equal(result, expected, check_exact=True)
+    assert (result.loc[result['match_id'] == 2, 'minutes'] == 0).all()
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from src.classes import FootballPitch
+
+# PITCH_ARC_POINTS of the dashboard
+ARC_POINTS = 100
+
+
+def serialized_size(fig):
+    return len(fig.to_json().encode())
+
+
+@pytest.mark.parametrize('half, max_bytes', [(False, 5000), (True, 3500)])
+def test_compact_pitch_size(half, max_bytes):
+    pitch = FootballPitch(half=half)
+    traces = pitch.plot_pitch(False, arc_points=ARC_POINTS)
+    compact = pitch.plot_pitch(False, arc_points=ARC_POINTS, compact=True)
+
+    assert not compact.data
+    assert serialized_size(compact) <= max_bytes
+    assert serialized_size(compact) * 3 <= serialized_size(traces)
+
+
+@pytest.mark.parametrize('plot_corner_arcs', [False, True])
+def test_compact_pitch_smaller_than_traces(plot_corner_arcs):
+    pitch = FootballPitch()
+    for arc_points in [ARC_POINTS, FootballPitch.ARC_POINTS]:
+        traces = pitch.plot_pitch(False, plot_corner_arcs=plot_corner_arcs, arc_points=arc_points)
+        compact = pitch.plot_pitch(False, plot_corner_arcs=plot_corner_arcs, arc_points=arc_points, compact=True)
+        assert serialized_size(compact) * 3 <= serialized_size(traces)
+
+
+def test_compact_heatmap_size():
+    pitch = FootballPitch()
+    counts = np.ones((23, 35), dtype=int)
+    traces = pitch.plot_heatmap(counts, arc_points=ARC_POINTS)
+    compact = pitch.plot_heatmap(counts, arc_points=ARC_POINTS, compact=True)
+
+    # Only the heatmap itself, the lines are shapes
+    assert len(compact.data) == 1
+    assert serialized_size(compact) <= 8500
+    assert serialized_size(compact) * 2 <= serialized_size(traces)